@@ -0,0 +1,18 @@
+import gc
+import multiprocessing
+import os
+
+bind = os.environ.get("WEB_BIND", "127.0.0.1:8000")
+workers = int(os.environ.get("WEB_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("WEB_THREADS", 1))
+# load the data once in the master; workers share it copy-on-write after fork
+preload_app = True
+timeout = 30
+graceful_timeout = 30
+accesslog = os.environ.get("WEB_ACCESS_LOG")  # e.g. "-" for stdout
+
+
+def when_ready(server):
+    # keep the preloaded objects out of the GC's reach so collections in the
+    # workers do not touch (and copy) the shared pages
+    gc.freeze()
@@ -1,7 +1,15 @@
 from __future__ import annotations
-from typing import List, Dict, Optional
+import argparse
+import csv
+import json
+import shlex
+import sys
+from typing import List, Dict, Optional, TextIO, Iterable
+from .storage import JsonStore
+from .repositories import Repos
 from .services import AccountingService
 from .domain import MovementType
+from .integrity import check
 
 
 def _input_nonempty(prompt: str) -> str:
@@ -15,17 +23,53 @@ def _input_int(prompt: str) -> int:
     return int(_input_nonempty(prompt))
 
 
-def _input_lines() -> List[Dict[str, int]]:
-    lines: List[Dict[str, int]] = []
+def _input_lines(with_price: bool = False) -> List[Dict]:
+    lines: List[Dict] = []
     n = _input_int("How many lines? ")
     for i in range(n):
         cid = _input_nonempty(f"  component_id[{i+1}]: ")
         qty = _input_int(f"  qty[{i+1}]: ")
-        lines.append({"component_id": cid, "qty": qty})
+        ln: Dict = {"component_id": cid, "qty": qty}
+        if with_price:
+            price = input(f"  unit_price[{i+1}](optional): ").strip()
+            if price:
+                ln["unit_price"] = float(price)
+        lines.append(ln)
     return lines
 
 
-def run_cli(svc: AccountingService) -> None:
+class _LockedService:
+    """
+    AccountingService for the interactive menu, which stays open while the web server and
+    other CLI commands write to the same data directory: every call holds the data-directory
+    lock and first reloads the data if anyone else has saved since the last call.
+    """
+    def __init__(self, store: JsonStore):
+        self._store = store
+        self._svc: Optional[AccountingService] = None
+        self._generation: Optional[int] = None
+
+    def __getattr__(self, name: str):
+        getattr(AccountingService, name)  # unknown names raise AttributeError right away
+
+        def call(*args, **kwargs):
+            with self._store.lock():
+                gen = self._store.generation()
+                if self._svc is None or gen != self._generation:
+                    self._svc = AccountingService(Repos(self._store))
+                try:
+                    result = getattr(self._svc, name)(*args, **kwargs)
+                except Exception:
+                    # a failed call may leave in-memory state half-applied
+                    self._svc = None
+                    raise
+                self._generation = self._store.generation()
+                return result
+        return call
+
+
+def run_cli(store: JsonStore) -> None:
+    svc = _LockedService(store)
     while True:
         print("\n=== Electrical Equipment Production Accounting (CLI) ===")
         print("1) Create product")
@@ -39,6 +83,9 @@ def run_cli(svc: AccountingService) -> None:
         print("9) Record test PASS/FAIL")
         print("10) Ship unit")
         print("11) Write-off unit")
+        print("12) Shortage forecast for open orders")
+        print("13) Stock valuation (FIFO)")
+        print("14) Material cost per order")
         print("0) Exit")
         choice = input("Select: ").strip()
 
@@ -78,7 +125,7 @@ def run_cli(svc: AccountingService) -> None:
                 print("OK")
             elif choice == "6":
                 mtype = _input_nonempty("type (INCOME/ISSUE/RETURN/WRITE_OFF): ").upper()
-                lines = _input_lines()
+                lines = _input_lines(with_price=(mtype == MovementType.INCOME.value))
                 oid_txt = input("order_id(optional): ").strip()
                 oid = int(oid_txt) if oid_txt else None
                 note = input("note(optional): ").strip()
@@ -109,10 +156,317 @@ def run_cli(svc: AccountingService) -> None:
                 sn = _input_nonempty("serial_no: ")
                 svc.write_off_unit(sn)
                 print("OK")
+            elif choice == "12":
+                rows = svc.shortage_forecast()
+                if not rows:
+                    print("(no shortages)")
+                else:
+                    for r in rows:
+                        f = r["first_shortage"]
+                        print(f"order {r['order_id']} ({r['product_id']}, deadline {r['deadline'] or '-'}): "
+                              f"{f['component_id']} missing {f['missing']} of {f['required']}"
+                              f" (+{r['short_components'] - 1} more)")
+            elif choice == "13":
+                rows = svc.stock_valuation()
+                if not rows:
+                    print("(empty)")
+                for r in rows:
+                    print(f"{r['component_id']}: qty={r['qty']} value={r['value']:.2f} avg={r['avg_unit_cost']}"
+                          f" written_off={r['written_off_qty']} ({r['written_off_value']:.2f})")
+            elif choice == "14":
+                rows = svc.order_material_costs()
+                if not rows:
+                    print("(empty)")
+                for r in rows:
+                    print(f"order {r['order_id']} ({r['product_id']}): material_cost={r['material_cost']:.2f}")
             elif choice == "0":
                 print("Bye.")
                 return
             else:
                 print("Unknown option.")
         except Exception as e:
-            print(f"ERROR: {e}")
\ No newline at end of file
+            print(f"ERROR: {e}")
+
+
+# ---------- Non-interactive commands ----------
+
+class _ArgumentParser(argparse.ArgumentParser):
+    # raise instead of exiting so a bad line in a script does not kill the whole run
+    def error(self, message: str) -> None:
+        raise ValueError(f"{self.prog}: {message}")
+
+
+class _ScriptAborted(Exception):
+    pass
+
+
+def _pairs(items: Iterable[str], qty_key: str, allow_price: bool = False) -> List[Dict]:
+    lines: List[Dict] = []
+    for item in items:
+        if "=" not in item:
+            raise ValueError(f"Line format must be: component_id={qty_key}" + ("[@unit_price]" if allow_price else ""))
+        cid, qty = item.split("=", 1)
+        ln: Dict = {"component_id": cid.strip()}
+        if allow_price and "@" in qty:
+            qty, price = qty.split("@", 1)
+            ln["unit_price"] = float(price.strip())
+        ln[qty_key] = int(qty.strip())
+        lines.append(ln)
+    return lines
+
+
+def _print_rows(header: List[str], rows: List[List], fmt: str, out: TextIO) -> None:
+    if fmt == "csv":
+        w = csv.writer(out, lineterminator="\n")
+        w.writerow(header)
+        w.writerows(rows)
+    elif fmt == "json":
+        out.write(json.dumps([dict(zip(header, r)) for r in rows], ensure_ascii=False) + "\n")
+    elif not rows:
+        out.write("(empty)\n")
+    else:
+        for r in rows:
+            out.write(" ".join(str(x) for x in r) + "\n")
+
+
+def _cmd_product_add(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    svc.create_product(a.product_id, a.name, a.description)
+    out.write("OK\n")
+
+
+def _cmd_component_add(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    svc.create_component(a.component_id, a.name, a.unit)
+    out.write("OK\n")
+
+
+def _cmd_bom_set(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    svc.set_bom(a.product_id, _pairs(a.lines, "qty_per_unit"))
+    out.write("OK\n")
+
+
+def _cmd_order_add(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    oid = svc.create_order(a.product_id, a.planned_qty, a.deadline, a.note)
+    out.write(f"OK order_id={oid}\n")
+
+
+def _cmd_order_approve(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    svc.approve_order(a.order_id)
+    out.write("OK\n")
+
+
+def _cmd_movement_add(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    mid = svc.register_movement(a.type.upper(), _pairs(a.lines, "qty", allow_price=True), a.order, a.note, idempotency_key=a.idempotency_key)
+    out.write(f"OK movement_id={mid}\n")
+
+
+def _cmd_unit_register(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    svc.register_unit(a.order_id, a.serial_no, idempotency_key=a.idempotency_key)
+    out.write("OK\n")
+
+
+def _cmd_unit_register_range(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    if a.count <= 0:
+        raise ValueError("count must be positive")
+    svc.register_units(a.order_id, [f"{a.prefix}{n:0{a.width}d}" for n in range(a.start, a.start + a.count)])
+    out.write(f"OK registered={a.count}\n")
+
+
+def _cmd_unit_test(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    svc.record_test(a.serial_no, passed=(a.result.upper() == "PASS"), idempotency_key=a.idempotency_key)
+    out.write("OK\n")
+
+
+def _cmd_unit_ship(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    svc.ship_unit(a.serial_no, idempotency_key=a.idempotency_key)
+    out.write("OK\n")
+
+
+def _cmd_unit_write_off(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    svc.write_off_unit(a.serial_no, idempotency_key=a.idempotency_key)
+    out.write("OK\n")
+
+
+def _cmd_report_stock(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    bal = svc.component_balance()
+    _print_rows(["component_id", "balance"], [[k, bal[k]] for k in sorted(bal)], a.format, out)
+
+
+def _cmd_report_shortage(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    rows = []
+    for r in svc.shortage_forecast(detail=a.all):
+        for sh in r["shortages"] if a.all else [r["first_shortage"]]:
+            rows.append([r["order_id"], r["product_id"], r["deadline"] or "", sh["component_id"],
+                         sh["required"], sh["available"], sh["missing"]])
+    _print_rows(["order_id", "product_id", "deadline", "component_id", "required", "available", "missing"],
+                rows, a.format, out)
+
+
+def _cmd_report_valuation(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    rows = [[r["component_id"], r["qty"], r["value"], r["avg_unit_cost"], r["layers"], r["unpriced_received"],
+             r["written_off_qty"], r["written_off_value"]]
+            for r in svc.stock_valuation()]
+    _print_rows(["component_id", "qty", "value", "avg_unit_cost", "layers", "unpriced_received",
+                 "written_off_qty", "written_off_value"], rows, a.format, out)
+
+
+def _cmd_report_order_cost(svc: AccountingService, a: argparse.Namespace, out: TextIO) -> None:
+    rows = [[r["order_id"], r["product_id"], r["status"], r["planned_qty"], r["material_cost"], r["cost_per_unit"]]
+            for r in svc.order_material_costs()]
+    _print_rows(["order_id", "product_id", "status", "planned_qty", "material_cost", "cost_per_unit"], rows, a.format, out)
+
+
+def build_parser(script: bool = False) -> argparse.ArgumentParser:
+    p = _ArgumentParser(prog="script" if script else "accounting",
+                        description="Electrical Equipment Production Accounting")
+    if not script:
+        p.add_argument("--data-dir", help="data directory (default: ./data next to src)")
+        p.add_argument("--profile", action="store_true",
+                       help="trace service/storage calls and write a flame graph + summary to ./profiles on exit")
+        p.add_argument("--profile-dir", metavar="DIR", help="like --profile, but write to DIR")
+    # without a command the interactive menu is started
+    sub = p.add_subparsers(dest="group", required=script)
+
+    g = sub.add_parser("product").add_subparsers(dest="action", required=True)
+    c = g.add_parser("add")
+    c.add_argument("product_id")
+    c.add_argument("name")
+    c.add_argument("--description", default="")
+    c.set_defaults(func=_cmd_product_add)
+
+    g = sub.add_parser("component").add_subparsers(dest="action", required=True)
+    c = g.add_parser("add")
+    c.add_argument("component_id")
+    c.add_argument("name")
+    c.add_argument("--unit", default="pcs")
+    c.set_defaults(func=_cmd_component_add)
+
+    g = sub.add_parser("bom").add_subparsers(dest="action", required=True)
+    c = g.add_parser("set")
+    c.add_argument("product_id")
+    c.add_argument("lines", nargs="+", metavar="component_id=qty_per_unit")
+    c.set_defaults(func=_cmd_bom_set)
+
+    g = sub.add_parser("order").add_subparsers(dest="action", required=True)
+    c = g.add_parser("add")
+    c.add_argument("product_id")
+    c.add_argument("planned_qty", type=int)
+    c.add_argument("--deadline", default=None, help="YYYY-MM-DD")
+    c.add_argument("--note", default="")
+    c.set_defaults(func=_cmd_order_add)
+    c = g.add_parser("approve")
+    c.add_argument("order_id", type=int)
+    c.set_defaults(func=_cmd_order_approve)
+
+    g = sub.add_parser("movement").add_subparsers(dest="action", required=True)
+    c = g.add_parser("add")
+    c.add_argument("type", help="/".join(x.value for x in MovementType))
+    c.add_argument("lines", nargs="+", metavar="component_id=qty[@unit_price]")
+    c.add_argument("--order", type=int, default=None)
+    c.add_argument("--note", default="")
+    c.add_argument("--idempotency-key", default=None, help="replaying the same key returns the original result")
+    c.set_defaults(func=_cmd_movement_add)
+
+    g = sub.add_parser("unit").add_subparsers(dest="action", required=True)
+    c = g.add_parser("register")
+    c.add_argument("order_id", type=int)
+    c.add_argument("serial_no")
+    c.add_argument("--idempotency-key", default=None)
+    c.set_defaults(func=_cmd_unit_register)
+    c = g.add_parser("register-range", help="register PREFIX{START..START+COUNT-1}")
+    c.add_argument("order_id", type=int)
+    c.add_argument("--prefix", required=True)
+    c.add_argument("--start", type=int, default=1)
+    c.add_argument("--count", type=int, required=True)
+    c.add_argument("--width", type=int, default=4, help="zero-padded digits")
+    c.set_defaults(func=_cmd_unit_register_range)
+    c = g.add_parser("test")
+    c.add_argument("serial_no")
+    c.add_argument("result", choices=["PASS", "FAIL", "pass", "fail"])
+    c.add_argument("--idempotency-key", default=None)
+    c.set_defaults(func=_cmd_unit_test)
+    c = g.add_parser("ship")
+    c.add_argument("serial_no")
+    c.add_argument("--idempotency-key", default=None)
+    c.set_defaults(func=_cmd_unit_ship)
+    c = g.add_parser("write-off")
+    c.add_argument("serial_no")
+    c.add_argument("--idempotency-key", default=None)
+    c.set_defaults(func=_cmd_unit_write_off)
+
+    g = sub.add_parser("report").add_subparsers(dest="action", required=True)
+    for name, func in (("stock", _cmd_report_stock), ("shortage", _cmd_report_shortage),
+                       ("valuation", _cmd_report_valuation), ("order-cost", _cmd_report_order_cost)):
+        c = g.add_parser(name)
+        c.add_argument("--format", choices=["table", "csv", "json"], default="table")
+        c.set_defaults(func=func)
+        if name == "shortage":
+            c.add_argument("--all", action="store_true", help="every short component, not only the first per order")
+
+    if not script:
+        c = sub.add_parser("script", help="run many commands (one per line) from a file or stdin")
+        c.add_argument("file", nargs="?", default="-", help="path or - for stdin")
+        c.add_argument("--keep-going", action="store_true",
+                       help="report failing lines and save the rest instead of aborting")
+        c = sub.add_parser("check", help="validate the data directory")
+        c.add_argument("--rebuild", action="store_true", help="rebuild stored derived state (ID counters, FIFO snapshot, idempotency keys)")
+        c.add_argument("--workers", type=int, default=None, help="process pool size (default: CPU count)")
+        c.add_argument("--format", choices=["table", "csv", "json"], default="table")
+    return p
+
+
+def run_script(svc: AccountingService, src: TextIO, keep_going: bool = False,
+               out: TextIO = sys.stdout, err: TextIO = sys.stderr) -> int:
+    """
+    Runs one command per line (same syntax as the command line, without the program name)
+    against one loaded Repos. Everything is written once at the end; on the first failing
+    line nothing is written unless keep_going is set.
+    """
+    parser = build_parser(script=True)
+    failed = 0
+    try:
+        with svc.r.batch():
+            for lineno, raw in enumerate(src, start=1):
+                line = raw.strip()
+                if not line or line.startswith("#"):
+                    continue
+                try:
+                    args = parser.parse_args(shlex.split(line))
+                    args.func(svc, args, out)
+                except Exception as e:
+                    failed += 1
+                    err.write(f"ERROR line {lineno}: {e}\n")
+                    if not keep_going:
+                        raise _ScriptAborted()
+    except _ScriptAborted:
+        err.write("Aborted, nothing was saved.\n")
+        return 1
+    return 1 if failed else 0
+
+
+def run_check(svc: AccountingService, args: argparse.Namespace, out: TextIO = sys.stdout) -> int:
+    if args.rebuild:
+        for change in svc.r.rebuild_derived():
+            out.write(f"REBUILT {change}\n")
+    violations = check(svc.r, workers=args.workers)
+    rows = [[v.collection, v.record_id, v.message] for v in violations]
+    if rows or args.format != "table":
+        _print_rows(["collection", "record_id", "message"], rows, args.format, out)
+    else:
+        out.write("OK no violations\n")
+    return 1 if violations else 0
+
+
+def run_command(svc: AccountingService, args: argparse.Namespace) -> int:
+    try:
+        if args.group == "check":
+            return run_check(svc, args)
+        if args.group == "script":
+            if args.file == "-":
+                return run_script(svc, sys.stdin, args.keep_going)
+            with open(args.file, encoding="utf-8") as f:
+                return run_script(svc, f, args.keep_going)
+        args.func(svc, args, sys.stdout)
+        return 0
+    except Exception as e:
+        print(f"ERROR: {e}", file=sys.stderr)
+        return 1
@@ -24,6 +24,13 @@ class MovementType(str, Enum):
     WRITE_OFF = "WRITE_OFF"
 
 
+_INBOUND = frozenset((MovementType.INCOME.value, MovementType.RETURN.value))
+
+
+def movement_sign(mtype: str) -> int:
+    return 1 if mtype in _INBOUND else -1
+
+
 class UnitState(str, Enum):
     PRODUCED = "produced"
     TEST_FAILED = "test_failed"
@@ -79,9 +86,13 @@ class Order:
 class MovementLine:
     component_id: str
     qty: int
+    unit_price: Optional[float] = None  # INCOME only
 
     def to_dict(self) -> Dict[str, Any]:
-        return asdict(self)
+        d = asdict(self)
+        if d["unit_price"] is None:
+            del d["unit_price"]
+        return d
 
 
 @dataclass(frozen=True)
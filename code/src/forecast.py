@@ -0,0 +1,160 @@
+from __future__ import annotations
+from operator import itemgetter
+from typing import Dict, List, Any
+import numpy as np
+from .domain import OrderStatus
+from .repositories import Repos
+
+
+OPEN_STATUSES = (OrderStatus.APPROVED.value, OrderStatus.IN_PRODUCTION.value)
+# orders are walked in row blocks of about this many matrix cells, so memory stays
+# flat and each block stays in cache however many orders are open
+BLOCK_CELLS = 1 << 17
+
+
+def _deadline_key(o: Dict[str, Any]):
+    # orders without a deadline go last, ties broken by order_id
+    d = o.get("deadline")
+    return (d is None, d or "", int(o["order_id"]))
+
+
+def shortage_forecast(repos: Repos, balance: Dict[str, int], detail: bool = False) -> List[Dict[str, Any]]:
+    """
+    Walks open orders in deadline order and returns those that run out of stock, with the
+    first component to run out; detail=True also lists every short component.
+
+    BOM matrix B is products x components, demand matrix D is orders x products
+    (planned_qty on the order's product). D @ B gives the requirement of every order;
+    since each order has exactly one product, that product is done as a row gather.
+    Quantities already issued to an order are subtracted from its requirement.
+    """
+    orders = sorted((o for o in repos.orders.values() if o["status"] in OPEN_STATUSES), key=_deadline_key)
+    if not orders:
+        return []
+
+    product_ids = sorted({o["product_id"] for o in orders})
+    p_index = {pid: i for i, pid in enumerate(product_ids)}
+    boms = [repos.get_bom(pid) for pid in product_ids]
+    lines = [ln for b in boms for ln in b]
+    line_cids = list(map(itemgetter("component_id"), lines))
+    component_ids = sorted(set(line_cids))
+    if not component_ids:
+        return []
+    c_index = {cid: j for j, cid in enumerate(component_ids)}
+
+    bom = np.zeros((len(product_ids), len(component_ids)), dtype=np.int64)
+    line_rows = np.repeat(np.arange(len(product_ids)), [len(b) for b in boms])
+    line_cols = np.array(list(map(c_index.__getitem__, line_cids)), dtype=np.intp)
+    line_qty = np.array(list(map(itemgetter("qty_per_unit"), lines)), dtype=np.int64)
+    np.add.at(bom, (line_rows, line_cols), line_qty)
+
+    order_product = np.fromiter((p_index[o["product_id"]] for o in orders), dtype=np.intp, count=len(orders))
+    planned = np.fromiter((int(o["planned_qty"]) for o in orders), dtype=np.int64, count=len(orders))
+    stock = np.fromiter((max(int(balance.get(cid, 0)), 0) for cid in component_ids), dtype=np.int64, count=len(component_ids))
+
+    # total demand per product (column sums of D) times B bounds every component's need;
+    # components covered even by that bound can never go short and are dropped
+    demand = np.bincount(order_product, weights=planned, minlength=len(product_ids)).astype(np.int64)
+    total = demand @ bom
+    cand = np.flatnonzero(total > stock)
+    if cand.size == 0:
+        return []
+    cand_index = {int(j): k for k, j in enumerate(cand)}
+    # int32 halves memory on big matrices; the bound above also caps every cumulative sum
+    dtype = np.int32 if int(total[cand].max()) < np.iinfo(np.int32).max else np.int64
+    stock = stock[cand].astype(dtype)
+    planned = planned.astype(dtype)
+    bom = np.ascontiguousarray(bom[:, cand], dtype=dtype)
+
+    # already issued per (order, component), in the order's position order
+    i_rows: List[int] = []
+    i_cols: List[int] = []
+    i_vals: List[int] = []
+    if repos.issued:
+        for i, o in enumerate(orders):
+            for cid, qty in repos.issued.get(int(o["order_id"]), {}).items():
+                k = cand_index.get(c_index.get(cid, -1))
+                # more returned than issued leaves nothing to subtract
+                if k is not None and qty > 0:
+                    i_rows.append(i)
+                    i_cols.append(k)
+                    i_vals.append(qty)
+    i_rows_a = np.array(i_rows, dtype=np.intp)
+    i_cols_a = np.array(i_cols, dtype=np.intp)
+    i_vals_a = np.array(i_vals, dtype=dtype)
+
+    def line(j: int, need: int, miss: int) -> Dict[str, Any]:
+        return {"component_id": component_ids[cand[j]], "required": need,
+                "available": need - miss, "missing": miss}
+
+    result: List[Dict[str, Any]] = []
+    over = -stock  # cumulative requirement so far minus stock, per component
+    height = max(1, BLOCK_CELLS // len(cand))
+    for a in range(0, len(orders), height):
+        b = min(a + height, len(orders))
+        # orders x components: row gather of each order's product from B, times planned_qty
+        req = bom[order_product[a:b]]
+        req *= planned[a:b, None]
+        lo, hi = np.searchsorted(i_rows_a, (a, b))
+        if hi > lo:
+            np.subtract.at(req, (i_rows_a[lo:hi] - a, i_cols_a[lo:hi]), i_vals_a[lo:hi])
+            np.maximum(req, 0, out=req)
+
+        # missing[i, j] = min(cumulative requirement up to order i - stock, own requirement)
+        if len(cand) >= 64:
+            # row by row is several times faster than cumsum along axis 0 for wide rows
+            missing = np.empty_like(req)
+            for i in range(b - a):
+                over = np.add(over, req[i], out=missing[i])
+        else:
+            missing = np.cumsum(req, axis=0, dtype=dtype)
+            missing += over
+        over = missing[-1].copy()
+        np.minimum(missing, req, out=missing)
+
+        short = missing > 0
+        counts = np.count_nonzero(short, axis=1)
+        rows = np.flatnonzero(counts)
+        if rows.size == 0:
+            continue
+        # the first component to run out is the one covering the smallest share of the order,
+        # lowest component_id on ties (columns are in component_id order). Components used up
+        # before the order (nothing available) have share 0; every component is only partly
+        # available for the one order where it runs out, so fractional shares are rare.
+        gone = missing == req
+        gone &= short
+        first = gone.argmax(axis=1)
+        partial = np.flatnonzero((counts > 0) & ~gone.any(axis=1))
+        if partial.size:
+            first[partial] = _shares(req[partial], missing[partial], short[partial]).argmin(axis=1)
+        if detail:
+            # every short component of every short order, by share then component_id
+            sr, sc = np.nonzero(short)
+            need = req[sr, sc]
+            order = np.lexsort((sc, (need - missing[sr, sc]) / need, sr))
+            sc = sc[order]
+            bounds = np.r_[0, np.cumsum(counts[counts > 0])]
+
+        for n, i in enumerate(rows.tolist()):
+            o = orders[a + i]
+            j = int(first[i])
+            row = {
+                "order_id": int(o["order_id"]),
+                "product_id": o["product_id"],
+                "deadline": o.get("deadline"),
+                "status": o["status"],
+                "first_shortage": line(j, int(req[i, j]), int(missing[i, j])),
+                "short_components": int(counts[i]),
+            }
+            if detail:
+                row["shortages"] = [line(k, int(req[i, k]), int(missing[i, k]))
+                                    for k in sc[bounds[n]:bounds[n + 1]].tolist()]
+            result.append(row)
+    return result
+
+
+def _shares(req: np.ndarray, missing: np.ndarray, short: np.ndarray) -> np.ndarray:
+    """Available / required for short cells, inf elsewhere."""
+    share = np.full(req.shape, np.inf)
+    np.divide(req - missing, req, out=share, where=short)
+    return share
@@ -0,0 +1,247 @@
+from __future__ import annotations
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Any, Tuple, Iterable
+from .domain import OrderStatus, MovementType, UnitState, movement_sign
+from .repositories import Repos
+
+
+# below this many records a pool costs more than it saves
+PARALLEL_THRESHOLD = 50_000
+
+_SIGNS = {x.value: movement_sign(x.value) for x in MovementType}
+_ORDER_STATUSES = frozenset(x.value for x in OrderStatus)
+_UNIT_STATES = frozenset(x.value for x in UnitState)
+
+
+@dataclass(frozen=True)
+class Violation:
+    collection: str
+    record_id: str
+    message: str
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _key(value: Any) -> Optional[str]:
+    # ids and enum values are strings; anything else (lists, objects) cannot be looked up
+    return value if isinstance(value, str) else None
+
+
+def _as_int(value: Any) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+# ---------- Worker side ----------
+# Set by _init_worker. With the fork start method the data is inherited copy-on-write,
+# so tasks only carry (start, end) bounds.
+_W: Dict[str, Any] = {}
+
+
+def _init_worker(movements: List[Tuple[str, Dict]], units: List[Tuple[str, Dict]],
+                 component_ids: frozenset, order_ids: frozenset) -> None:
+    _W["movements"] = movements
+    _W["units"] = units
+    _W["component_ids"] = component_ids
+    _W["order_ids"] = order_ids
+
+
+def _check_movements(start: int, end: int):
+    """
+    Validates movements[start:end] and summarises their stock effect per component as
+    (net delta, lowest running total within the partition) for the sequential merge.
+    """
+    component_ids = _W["component_ids"]
+    order_ids = _W["order_ids"]
+    out: List[Violation] = []
+    running: Dict[str, int] = {}
+    lowest: Dict[str, int] = {}
+    for key, mv in _W["movements"][start:end]:
+        if not isinstance(mv, dict):
+            out.append(Violation("movements", key, "record is not an object"))
+            continue
+        if str(mv.get("movement_id")) != key:
+            out.append(Violation("movements", key, f"movement_id {mv.get('movement_id')!r} does not match key"))
+        sign = _SIGNS.get(_key(mv.get("type")))
+        if sign is None:
+            out.append(Violation("movements", key, f"unknown type {mv.get('type')!r}"))
+            continue
+        oid = mv.get("order_id")
+        if oid is not None and str(oid) not in order_ids:
+            out.append(Violation("movements", key, f"references missing order {oid}"))
+        lines = mv.get("lines")
+        if not isinstance(lines, list):
+            out.append(Violation("movements", key, "lines must be a list of objects"))
+            continue
+        for ln in lines:
+            if not isinstance(ln, dict):
+                out.append(Violation("movements", key, "lines must be a list of objects"))
+                break
+            raw = ln.get("component_id")
+            cid = _key(raw)
+            qty = _as_int(ln.get("qty"))
+            if cid not in component_ids:
+                out.append(Violation("movements", key, f"references missing component {raw!r}"))
+            if qty is None:
+                out.append(Violation("movements", key, f"invalid qty {ln.get('qty')!r} for {raw!r}"))
+                continue
+            if qty <= 0:
+                out.append(Violation("movements", key, f"non-positive qty {qty} for {raw!r}"))
+            if cid is None:
+                continue
+            r = running.get(cid, 0) + sign * qty
+            running[cid] = r
+            if r < lowest.get(cid, 0):
+                lowest[cid] = r
+    return out, running, lowest
+
+
+def _check_units(start: int, end: int) -> List[Violation]:
+    order_ids = _W["order_ids"]
+    out: List[Violation] = []
+    for key, u in _W["units"][start:end]:
+        if not isinstance(u, dict):
+            out.append(Violation("units", key, "record is not an object"))
+            continue
+        if u.get("serial_no") != key:
+            out.append(Violation("units", key, f"serial_no {u.get('serial_no')!r} does not match key"))
+        if str(u.get("order_id")) not in order_ids:
+            out.append(Violation("units", key, f"references missing order {u.get('order_id')}"))
+        if _key(u.get("state")) not in _UNIT_STATES:
+            out.append(Violation("units", key, f"unknown state {u.get('state')!r}"))
+    return out
+
+
+# ---------- Main process ----------
+def _bounds(n: int, parts: int) -> List[Tuple[int, int]]:
+    size = max(1, -(-n // parts))
+    return [(i, min(i + size, n)) for i in range(0, n, size)]
+
+
+def _first_negatives(movements: Iterable[Tuple[str, Dict]], balance: Dict[str, int]) -> Dict[str, str]:
+    """Replays a partition for the given components only; returns component -> first movement key below zero."""
+    balance = dict(balance)
+    found: Dict[str, str] = {}
+    for key, mv in movements:
+        sign = _SIGNS.get(_key(mv.get("type"))) if isinstance(mv, dict) else None
+        if sign is None:
+            continue
+        lines = mv.get("lines")
+        if not isinstance(lines, list):
+            continue
+        for ln in lines:
+            cid = _key(ln.get("component_id")) if isinstance(ln, dict) else None
+            qty = _as_int(ln.get("qty")) if cid is not None else None
+            if cid in balance and cid not in found and qty is not None:
+                balance[cid] += sign * qty
+                if balance[cid] < 0:
+                    found[cid] = key
+        if len(found) == len(balance):
+            break
+    return found
+
+
+def _check_small(repos: Repos) -> List[Violation]:
+    out: List[Violation] = []
+    for name in ("products", "components", "orders"):
+        for key, rec in getattr(repos, name).items():
+            if not isinstance(rec, dict):
+                out.append(Violation(name, key, "record is not an object"))
+    for key, p in repos.products.items():
+        if isinstance(p, dict) and p.get("product_id") != key:
+            out.append(Violation("products", key, "product_id does not match key"))
+    for key, c in repos.components.items():
+        if isinstance(c, dict) and c.get("component_id") != key:
+            out.append(Violation("components", key, "component_id does not match key"))
+    for pid, lines in repos.bom.items():
+        if pid not in repos.products:
+            out.append(Violation("bom", pid, "BOM for missing product"))
+        if not isinstance(lines, list) or not all(isinstance(ln, dict) for ln in lines):
+            out.append(Violation("bom", pid, "lines must be a list of objects"))
+            continue
+        for ln in lines:
+            if _key(ln.get("component_id")) not in repos.components:
+                out.append(Violation("bom", pid, f"references missing component {ln.get('component_id')!r}"))
+            qty = _as_int(ln.get("qty_per_unit"))
+            if qty is None or qty <= 0:
+                out.append(Violation("bom", pid, f"invalid qty_per_unit {ln.get('qty_per_unit')!r} for {ln.get('component_id')!r}"))
+    for key, o in repos.orders.items():
+        if not isinstance(o, dict):
+            continue
+        if str(o.get("order_id")) != key:
+            out.append(Violation("orders", key, f"order_id {o.get('order_id')!r} does not match key"))
+        if _key(o.get("product_id")) not in repos.products:
+            out.append(Violation("orders", key, f"references missing product {o.get('product_id')!r}"))
+        if _key(o.get("status")) not in _ORDER_STATUSES:
+            out.append(Violation("orders", key, f"unknown status {o.get('status')!r}"))
+
+    for key in repos.movements:
+        if not key.isdigit():
+            out.append(Violation("movements", key, "movement key is not a number"))
+
+    max_oid = repos.max_order_id()
+    if repos.meta.next_order_id <= max_oid:
+        out.append(Violation("meta", "next_order_id", f"{repos.meta.next_order_id} is not above existing order {max_oid}"))
+    max_mid = repos.max_movement_id()
+    if repos.meta.next_movement_id <= max_mid:
+        out.append(Violation("meta", "next_movement_id", f"{repos.meta.next_movement_id} is not above existing movement {max_mid}"))
+    return out
+
+
+def check(repos: Repos, workers: Optional[int] = None) -> List[Violation]:
+    """
+    Validates every collection. Movements and units are split into partitions checked in a
+    process pool; per-partition stock summaries are merged in movement_id order to find the
+    first movement that takes a component below zero.
+    """
+    out = _check_small(repos)
+    # same order as the balance replay in Repos
+    movements = repos.movement_items()
+    units = list(repos.units.items())
+    initargs = (movements, units, frozenset(repos.components), frozenset(repos.orders))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if len(movements) + len(units) < PARALLEL_THRESHOLD:
+        workers = 1
+    m_bounds = _bounds(len(movements), workers * 4)
+    u_bounds = _bounds(len(units), workers * 4)
+
+    if workers > 1:
+        methods = multiprocessing.get_all_start_methods()
+        ctx = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                 initializer=_init_worker, initargs=initargs) as pool:
+            m_futs = [pool.submit(_check_movements, a, b) for a, b in m_bounds]
+            u_futs = [pool.submit(_check_units, a, b) for a, b in u_bounds]
+            m_results = [f.result() for f in m_futs]
+            u_results = [f.result() for f in u_futs]
+    else:
+        _init_worker(*initargs)
+        m_results = [_check_movements(a, b) for a, b in m_bounds]
+        u_results = [_check_units(a, b) for a, b in u_bounds]
+        _W.clear()
+
+    balance: Dict[str, int] = {}
+    reported = set()
+    for (a, b), (viol, running, lowest) in zip(m_bounds, m_results):
+        out.extend(viol)
+        flagged = {cid: balance.get(cid, 0) for cid, low in lowest.items()
+                   if cid not in reported and balance.get(cid, 0) + low < 0}
+        if flagged:
+            reported.update(flagged)
+            for cid, key in sorted(_first_negatives(movements[a:b], flagged).items()):
+                out.append(Violation("movements", key, f"stock of {cid!r} goes negative"))
+        for cid, delta in running.items():
+            balance[cid] = balance.get(cid, 0) + delta
+    for viol in u_results:
+        out.extend(viol)
+    return out
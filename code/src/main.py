@@ -1,17 +1,43 @@
+import gc
+import sys
 from pathlib import Path
 from .storage import JsonStore
 from .repositories import Repos
 from .services import AccountingService
-from .cli import run_cli
+from .cli import run_cli, build_parser, run_command
+from . import profiling
 
 
 def main() -> None:
-    base = Path(__file__).resolve().parent.parent / "data"
+    try:
+        args = build_parser().parse_args()
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    if args.profile or args.profile_dir:
+        profiler = profiling.enable(Path(args.profile_dir) if args.profile_dir else None)
+    else:
+        profiler = profiling.enable_from_env()
+
+    base = Path(args.data_dir) if args.data_dir else Path(__file__).resolve().parent.parent / "data"
     store = JsonStore(base)
-    repos = Repos(store)
-    svc = AccountingService(repos)
-    run_cli(svc)
+    if args.group is None:
+        session = lambda: run_cli(store)
+        root = "cli interactive"
+    else:
+        def session() -> int:
+            # hold the data-directory lock so a running web server does not interleave its writes
+            with store.lock():
+                # check replays the movements itself, so the balance replay on load is skipped
+                repos = Repos(store, derived=args.group != "check")
+                # the loaded records live until exit; keeping them out of the collector's
+                # scans saves seconds on big data directories
+                gc.freeze()
+                return run_command(AccountingService(repos), args)
+        root = f"cli {args.group} {getattr(args, 'action', '')}".rstrip()
+    code = profiler.call(root, session) if profiler is not None else session()
+    sys.exit(code or 0)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
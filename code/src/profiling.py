@@ -0,0 +1,180 @@
+from __future__ import annotations
+import atexit
+import functools
+import heapq
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .storage import JsonStore
+from .repositories import Repos
+from .services import AccountingService
+
+
+# ACCOUNTING_PROFILE=1 writes to ./profiles next to src, any other value is taken as the output directory
+ENV_VAR = "ACCOUNTING_PROFILE"
+DEFAULT_DIR = Path(__file__).resolve().parent.parent / "profiles"
+TOP_N = 20
+
+REPO_MUTATIONS = (
+    "flush_all", "add_product", "add_component", "set_bom", "new_order_id", "add_order",
+    "update_order_status", "new_movement_id", "add_movement", "add_unit", "update_unit_state",
+    "put_idempotent", "rebuild_stock", "build_fifo", "save_fifo_snapshot", "rebuild_derived",
+)
+SIZED_COLLECTIONS = ("orders", "movements", "units")
+
+
+class Profiler:
+    """
+    Traces instrumented calls with wall time, bytes written/read and collection sizes.
+    Nested calls form stacks that are dumped in the folded format used by flamegraph.pl
+    and speedscope (self time in microseconds), plus a top-N summary.
+    """
+    def __init__(self, out_dir: Path, top_n: int = TOP_N):
+        self.out_dir = out_dir
+        self.top_n = top_n
+        self.reset()
+
+    def reset(self) -> None:
+        # also called in forked children, where a lock held by another thread would never be released
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started = time.time()
+        self.folded: Dict[str, float] = {}  # stack -> self seconds
+        self.totals: Dict[str, List[float]] = {}  # name -> [calls, seconds, max seconds, bytes]
+        self.slowest: List[Tuple[float, int, Dict[str, Any]]] = []  # min-heap of top_n calls
+        self._seq = 0
+
+    def _stack(self) -> List[List[Any]]:
+        st = getattr(self._local, "stack", None)
+        if st is None:
+            st = self._local.stack = []
+        return st
+
+    def call(self, name: str, fn: Callable[[], Any], info: Optional[Callable[[Any], Dict[str, Any]]] = None) -> Any:
+        stack = self._stack()
+        frame = [name, 0.0]  # name, time spent in children
+        stack.append(frame)
+        t0 = time.perf_counter()
+        result = None
+        try:
+            result = fn()
+            return result
+        finally:
+            wall = time.perf_counter() - t0
+            stack.pop()
+            if stack:
+                stack[-1][1] += wall
+            extra = info(result) if info is not None else {}
+            path = ";".join(f[0] for f in stack) + (";" if stack else "") + name
+            self._record(name, path, wall, wall - frame[1], extra)
+
+    def _record(self, name: str, path: str, wall: float, self_time: float, extra: Dict[str, Any]) -> None:
+        with self._lock:
+            self.folded[path] = self.folded.get(path, 0.0) + self_time
+            t = self.totals.setdefault(name, [0, 0.0, 0.0, 0])
+            t[0] += 1
+            t[1] += wall
+            t[2] = max(t[2], wall)
+            t[3] += int(extra.get("bytes", 0))
+            self._seq += 1
+            entry = (wall, self._seq, {"name": name, "stack": path, "wall": wall, **extra})
+            if len(self.slowest) < self.top_n:
+                heapq.heappush(self.slowest, entry)
+            elif wall > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def dump(self) -> Optional[Path]:
+        with self._lock:
+            if not self.totals:
+                return None
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+            base = self.out_dir / f"{stamp}-{os.getpid()}"
+            with open(base.with_suffix(".folded"), "w", encoding="utf-8") as f:
+                for path, secs in sorted(self.folded.items()):
+                    f.write(f"{path} {max(1, round(secs * 1e6))}\n")
+            with open(base.with_suffix(".txt"), "w", encoding="utf-8") as f:
+                f.write(self.summary())
+            return base
+
+    def summary(self) -> str:
+        lines = [f"{'operation':<40} {'calls':>7} {'total ms':>10} {'avg ms':>9} {'max ms':>9} {'bytes':>12}"]
+        for name, (calls, total, mx, nbytes) in sorted(self.totals.items(), key=lambda kv: -kv[1][1]):
+            lines.append(f"{name:<40} {int(calls):>7} {total * 1e3:>10.2f} {total / calls * 1e3:>9.3f} {mx * 1e3:>9.3f} {int(nbytes):>12}")
+        lines.append("")
+        lines.append(f"Top {self.top_n} slowest calls:")
+        for wall, _, e in sorted(self.slowest, reverse=True):
+            details = " ".join(f"{k}={v}" for k, v in e.items() if k not in ("name", "stack", "wall"))
+            lines.append(f"{wall * 1e3:>10.3f} ms  {e['stack']}  {details}")
+        return "\n".join(lines) + "\n"
+
+    # ---------- Roots ----------
+    def wsgi_middleware(self, wsgi_app: Callable) -> Callable:
+        def app(environ, start_response):
+            name = f"{environ.get('REQUEST_METHOD', '')} {environ.get('PATH_INFO', '')}"
+            return self.call(name, lambda: wsgi_app(environ, start_response))
+        return app
+
+
+def _repo_sizes(repos: Repos) -> Dict[str, Any]:
+    return {name: len(getattr(repos, name)) for name in SIZED_COLLECTIONS}
+
+
+def _wrap(cls: type, attr: str, profiler: Profiler, info: Callable[..., Dict[str, Any]]) -> None:
+    orig = getattr(cls, attr)
+    if getattr(orig, "__profiled__", False):
+        return
+    name = f"{cls.__name__}.{attr}"
+
+    @functools.wraps(orig)
+    def wrapper(self, *args, **kwargs):
+        return profiler.call(name, lambda: orig(self, *args, **kwargs),
+                             lambda result: info(self, args, result))
+    wrapper.__profiled__ = True
+    setattr(cls, attr, wrapper)
+
+
+def _store_info(store: JsonStore, name: str, data: Any) -> Dict[str, Any]:
+    p = store._path(name)
+    return {
+        "collection": name,
+        "records": len(data) if hasattr(data, "__len__") else 0,
+        "bytes": p.stat().st_size if p.exists() else 0,
+    }
+
+
+def install(profiler: Profiler) -> None:
+    """Wraps JsonStore.load/save, Repos mutations and public AccountingService methods."""
+    _wrap(JsonStore, "load", profiler, lambda store, args, result: _store_info(store, args[0], result))
+    _wrap(JsonStore, "save", profiler, lambda store, args, result: _store_info(store, args[0], args[1]))
+    for attr in REPO_MUTATIONS:
+        _wrap(Repos, attr, profiler, lambda repos, args, result: _repo_sizes(repos))
+    for attr in list(vars(AccountingService)):
+        if not attr.startswith("_") and callable(getattr(AccountingService, attr)):
+            _wrap(AccountingService, attr, profiler, lambda svc, args, result: _repo_sizes(svc.r))
+
+
+_active: Optional[Profiler] = None
+
+
+def enable(out_dir: Optional[Path] = None) -> Profiler:
+    """Installs the hooks once per process; the profile is written when the process exits."""
+    global _active
+    if _active is None:
+        _active = Profiler(out_dir or DEFAULT_DIR)
+        install(_active)
+        atexit.register(_active.dump)
+        # forked web workers start their own session instead of repeating the parent's
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=_active.reset)
+    return _active
+
+
+def enable_from_env() -> Optional[Profiler]:
+    value = os.environ.get(ENV_VAR, "").strip()
+    if not value or value == "0":
+        return None
+    return enable(None if value == "1" else Path(value))
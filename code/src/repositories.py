@@ -1,29 +1,77 @@
 from __future__ import annotations
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Any
+from itertools import islice
+from typing import Dict, List, Optional, Any, Iterable, Iterator, Set, Tuple
 from .storage import JsonStore
-from .domain import Product, Component, BomLine, Order, Movement, MovementLine, SerialUnit, utcnow_iso, OrderStatus
+from .valuation import FifoLedger
+from .domain import Product, Component, BomLine, Order, Movement, MovementLine, SerialUnit, utcnow_iso, OrderStatus, MovementType, movement_sign
+
+
+_MOVEMENT_TYPES = frozenset(x.value for x in MovementType)
+_SIGNS = {x.value: movement_sign(x.value) for x in MovementType}
+_ORDER_TRACKED = frozenset((MovementType.ISSUE.value, MovementType.RETURN.value))
+
+
+def _id_order(key: str):
+    return (0, int(key), "") if key.isdigit() else (1, 0, key)
+
+
+def _replayable(mv: Any) -> bool:
+    try:
+        if mv["type"] not in _MOVEMENT_TYPES:
+            return False
+        if mv.get("order_id") is not None:
+            int(mv["order_id"])
+        for ln in mv["lines"]:
+            if not isinstance(ln["component_id"], str):
+                return False
+            int(ln["qty"])
+            if ln.get("unit_price") is not None:
+                float(ln["unit_price"])
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return False
+    return True
+
+
+# once this many movements were added since the last FIFO snapshot, the ledger is written
+# to fifo.json again, so loading it only replays the movements added since
+FIFO_SNAPSHOT_EVERY = 1_000
+
+IDEMPOTENCY_MAX_KEYS = 10_000
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600
 
 
 @dataclass
 class Meta:
     next_order_id: int = 1
     next_movement_id: int = 1
+    fifo_movements: int = 0  # movements covered by the FIFO snapshot
 
     def to_dict(self) -> Dict[str, Any]:
-        return {"next_order_id": self.next_order_id, "next_movement_id": self.next_movement_id}
+        return {"next_order_id": self.next_order_id, "next_movement_id": self.next_movement_id,
+                "fifo_movements": self.fifo_movements}
 
     @staticmethod
     def from_dict(d: Dict[str, Any]) -> "Meta":
-        return Meta(next_order_id=int(d.get("next_order_id", 1)), next_movement_id=int(d.get("next_movement_id", 1)))
+        return Meta(next_order_id=int(d.get("next_order_id", 1)), next_movement_id=int(d.get("next_movement_id", 1)),
+                    fifo_movements=int(d.get("fifo_movements", 0)))
 
 
 class Repos:
     """
     Text-file repositories (JSON). Later you can replace with MySQL implementations.
     """
-    def __init__(self, store: JsonStore):
+    def __init__(self, store: JsonStore, derived: bool = True):
+        # derived=False skips the balance replay, for tools that only read the stored records
         self.store = store
+        self._derived = derived
+        self._load()
+        self._batch_depth = 0
+        self._dirty: Set[str] = set()
+
+    def _load(self) -> None:
         self.meta = Meta.from_dict(self.store.load("meta", {}))
         self.products: Dict[str, Dict[str, Any]] = self.store.load("products", {})
         self.components: Dict[str, Dict[str, Any]] = self.store.load("components", {})
@@ -31,20 +79,167 @@ class Repos:
         self.orders: Dict[str, Dict[str, Any]] = self.store.load("orders", {})  # order_id str -> dict
         self.movements: Dict[str, Dict[str, Any]] = self.store.load("movements", {})  # movement_id str -> dict
         self.units: Dict[str, Dict[str, Any]] = self.store.load("units", {})  # serial_no -> dict
+        self.idempotency: Dict[str, Dict[str, Any]] = self.store.load("idempotency", {})  # key -> stored result, oldest first
+        # derived from movements, not stored
+        self.balances: Dict[str, int] = {}  # component_id -> qty
+        self.issued: Dict[int, Dict[str, int]] = {}  # order_id -> component_id -> net ISSUE minus RETURN
+        if self._derived:
+            self.rebuild_stock()
+        # FIFO cost layers, loaded on first use from the last snapshot plus newer movements
+        self._fifo: Optional[FifoLedger] = None
+
+    def _collection(self, name: str) -> Any:
+        if name == "meta":
+            return self.meta.to_dict()
+        if name == "fifo":
+            # movements are stored in id order, so the snapshot covers the first n of them
+            return {"movements": len(self.movements), "last_movement_id": next(reversed(self.movements), None),
+                    "ledger": self.fifo.to_dict()}
+        return getattr(self, name)
+
+    def _save(self, name: str) -> None:
+        if self._batch_depth:
+            self._dirty.add(name)
+        else:
+            self._write(name)
+
+    def _write(self, name: str) -> None:
+        # the FIFO snapshot is large and only read back by this code, so it is not indented
+        self.store.save(name, self._collection(name), compact=(name == "fifo"))
+
+    @contextmanager
+    def batch(self) -> Iterator["Repos"]:
+        """
+        Defers file writes until the outermost batch exits, so every touched collection
+        is written once. If the batch raises or a write fails, whatever did not reach disk
+        is dropped from memory by reloading.
+        """
+        self._batch_depth += 1
+        ok = False
+        try:
+            yield self
+            ok = True
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                dirty, self._dirty = self._dirty, set()
+                if not ok:
+                    if dirty:
+                        self._load()
+                else:
+                    try:
+                        # idempotency keys go last: if anything before them fails, a retry
+                        # redoes the operation instead of replaying a result that is not on disk
+                        for name in sorted(dirty, key=lambda n: (n == "idempotency", n)):
+                            self._write(name)
+                    except BaseException:
+                        self._load()
+                        raise
 
     def flush_all(self) -> None:
-        self.store.save("meta", self.meta.to_dict())
-        self.store.save("products", self.products)
-        self.store.save("components", self.components)
-        self.store.save("bom", self.bom)
-        self.store.save("orders", self.orders)
-        self.store.save("movements", self.movements)
-        self.store.save("units", self.units)
+        for name in ("meta", "products", "components", "bom", "orders", "movements", "units", "idempotency"):
+            self.store.save(name, self._collection(name))
+
+    # --- Derived state ---
+    def rebuild_stock(self) -> None:
+        """
+        Recomputes balances by replaying movements in id order.
+        Malformed movements are skipped here and reported by `check`.
+        """
+        self.balances = {}
+        self.issued = {}
+        for mv in self.list_movements():
+            if _replayable(mv):
+                self._apply_stock(mv)
+
+    @property
+    def fifo(self) -> FifoLedger:
+        if self._fifo is None:
+            self._fifo = self.build_fifo()
+        return self._fifo
+
+    def build_fifo(self, use_snapshot: bool = True) -> FifoLedger:
+        """Loads the FIFO snapshot and replays the movements added since, or replays all of them."""
+        loaded = self._fifo_snapshot() if use_snapshot else None
+        if loaded is None:
+            ledger, tail = FifoLedger(), self.list_movements()
+        else:
+            ledger, n = loaded
+            tail = [self.movements[k] for k in islice(self.movements, n, None)]
+        for mv in tail:
+            if _replayable(mv):
+                ledger.apply(mv)
+        return ledger
+
+    def _fifo_snapshot(self) -> Optional[Tuple[FifoLedger, int]]:
+        """The stored FIFO ledger and how many movements it covers; None if missing or stale."""
+        snap = self.store.load("fifo", None)
+        if not snap:
+            return None
+        try:
+            n = snap["movements"]
+            # a snapshot that does not match the stored movements (edited or restored data) is ignored
+            if 0 < n <= len(self.movements) and next(islice(self.movements, n - 1, None)) == snap["last_movement_id"]:
+                return FifoLedger.from_dict(snap["ledger"]), n
+        except (KeyError, TypeError, ValueError, AttributeError):
+            pass
+        return None
+
+    @staticmethod
+    def _max_id(keys: Iterable[str]) -> int:
+        try:
+            return max(map(int, keys), default=0)
+        except ValueError:
+            return max((int(k) for k in keys if k.isdigit()), default=0)
+
+    def max_order_id(self) -> int:
+        return self._max_id(self.orders)
+
+    def max_movement_id(self) -> int:
+        return self._max_id(self.movements)
+
+    def rebuild_derived(self) -> List[str]:
+        """
+        Rewrites the stored derived state from the records: ID counters, the FIFO snapshot
+        and the idempotency keys. Balances are never stored, so there is nothing to fix there.
+        Returns what changed.
+        """
+        changes: List[str] = []
+        with self.batch():
+            max_oid = self.max_order_id()
+            if self.meta.next_order_id <= max_oid:
+                changes.append(f"next_order_id {self.meta.next_order_id} -> {max_oid + 1}")
+                self.meta.next_order_id = max_oid + 1
+                self._save("meta")
+            max_mid = self.max_movement_id()
+            if self.meta.next_movement_id <= max_mid:
+                changes.append(f"next_movement_id {self.meta.next_movement_id} -> {max_mid + 1}")
+                self.meta.next_movement_id = max_mid + 1
+                self._save("meta")
+
+            # a snapshot that is missing, stale or disagrees with a full replay is written again
+            ledger = self.build_fifo(use_snapshot=False)
+            loaded = self._fifo_snapshot()
+            if self.movements and (loaded is None or loaded[1] != self.meta.fifo_movements
+                                   or self.build_fifo().to_dict() != ledger.to_dict()):
+                changes.append(f"FIFO snapshot rewritten for {len(self.movements)} movements")
+                self._fifo = ledger
+                self.save_fifo_snapshot()
+
+            now = time.time()
+            live = [(k, e) for k, e in self.idempotency.items()
+                    if isinstance(e, dict) and "fingerprint" in e and isinstance(e.get("at"), (int, float))
+                    and now - e["at"] <= IDEMPOTENCY_TTL_SECONDS][-IDEMPOTENCY_MAX_KEYS:]
+            if len(live) != len(self.idempotency):
+                changes.append(f"{len(self.idempotency) - len(live)} expired, malformed or excess idempotency keys dropped")
+                self.idempotency = dict(live)
+                self._save("idempotency")
+        return changes
 
     # --- Products ---
     def add_product(self, p: Product) -> None:
         self.products[p.product_id] = p.to_dict()
-        self.store.save("products", self.products)
+        self._save("products")
 
     def get_product(self, product_id: str) -> Optional[Dict[str, Any]]:
         return self.products.get(product_id)
@@ -52,7 +247,7 @@ class Repos:
     # --- Components ---
     def add_component(self, c: Component) -> None:
         self.components[c.component_id] = c.to_dict()
-        self.store.save("components", self.components)
+        self._save("components")
 
     def get_component(self, component_id: str) -> Optional[Dict[str, Any]]:
         return self.components.get(component_id)
@@ -60,7 +255,7 @@ class Repos:
     # --- BOM ---
     def set_bom(self, product_id: str, lines: List[BomLine]) -> None:
         self.bom[product_id] = [ln.to_dict() for ln in lines]
-        self.store.save("bom", self.bom)
+        self._save("bom")
 
     def get_bom(self, product_id: str) -> List[Dict[str, Any]]:
         return list(self.bom.get(product_id, []))
@@ -69,12 +264,12 @@ class Repos:
     def new_order_id(self) -> int:
         oid = self.meta.next_order_id
         self.meta.next_order_id += 1
-        self.store.save("meta", self.meta.to_dict())
+        self._save("meta")
         return oid
 
     def add_order(self, o: Order) -> None:
         self.orders[str(o.order_id)] = o.to_dict()
-        self.store.save("orders", self.orders)
+        self._save("orders")
 
     def get_order(self, order_id: int) -> Optional[Dict[str, Any]]:
         return self.orders.get(str(order_id))
@@ -85,27 +280,62 @@ class Repos:
             raise ValueError("Order not found")
         o["status"] = status
         self.orders[str(order_id)] = o
-        self.store.save("orders", self.orders)
+        self._save("orders")
 
     # --- Movements ---
     def new_movement_id(self) -> int:
         mid = self.meta.next_movement_id
         self.meta.next_movement_id += 1
-        self.store.save("meta", self.meta.to_dict())
+        self._save("meta")
         return mid
 
     def add_movement(self, m: Movement) -> None:
-        self.movements[str(m.movement_id)] = m.to_dict()
-        self.store.save("movements", self.movements)
+        d = m.to_dict()
+        self.movements[str(m.movement_id)] = d
+        self._apply_stock(d)
+        if self._fifo is not None:
+            self._fifo.apply(d)
+        self._save("movements")
+        # also when movements were removed behind the snapshot's back
+        if not 0 <= len(self.movements) - self.meta.fifo_movements < FIFO_SNAPSHOT_EVERY:
+            self.save_fifo_snapshot()
+
+    def save_fifo_snapshot(self) -> None:
+        self.meta.fifo_movements = len(self.movements)
+        self._save("fifo")
+        self._save("meta")
+
+    def _apply_stock(self, mv: Dict[str, Any]) -> None:
+        mtype = mv["type"]
+        sign = _SIGNS[mtype]
+        oid = mv.get("order_id")
+        per = None
+        if oid is not None and mtype in _ORDER_TRACKED:
+            per = self.issued.setdefault(int(oid), {})
+        balances = self.balances
+        for ln in mv["lines"]:
+            cid = ln["component_id"]
+            qty = sign * int(ln["qty"])
+            balances[cid] = balances.get(cid, 0) + qty
+            if per is not None:
+                per[cid] = per.get(cid, 0) - qty
 
     def list_movements(self) -> List[Dict[str, Any]]:
-        # sort by id
-        return [self.movements[k] for k in sorted(self.movements.keys(), key=lambda x: int(x))]
+        return [mv for _, mv in self.movement_items()]
+
+    def movement_items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        # sort by id; keys that are not numbers (broken data) go last
+        items = list(self.movements.items())
+        if not all(map(str.isdigit, self.movements)):
+            return sorted(items, key=lambda kv: _id_order(kv[0]))
+        # keys are normally stored in id order already, which makes this sort linear
+        ids = list(map(int, self.movements))
+        return [items[i] for i in sorted(range(len(ids)), key=ids.__getitem__)]
 
     # --- Units ---
     def add_unit(self, u: SerialUnit) -> None:
         self.units[u.serial_no] = u.to_dict()
-        self.store.save("units", self.units)
+        self._save("units")
 
     def get_unit(self, serial_no: str) -> Optional[Dict[str, Any]]:
         return self.units.get(serial_no)
@@ -116,4 +346,23 @@ class Repos:
             raise ValueError("Serial unit not found")
         u["state"] = state
         self.units[serial_no] = u
-        self.store.save("units", self.units)
\ No newline at end of file
+        self._save("units")
+
+    # --- Idempotency keys ---
+    def get_idempotent(self, key: str) -> Optional[Dict[str, Any]]:
+        e = self.idempotency.get(key)
+        if e is None or time.time() - e["at"] > IDEMPOTENCY_TTL_SECONDS:
+            return None
+        return e
+
+    def put_idempotent(self, key: str, fingerprint: str, result: Any) -> None:
+        now = int(time.time())
+        self.idempotency.pop(key, None)
+        # entries are kept in insertion order, so expired and excess ones are at the front
+        while self.idempotency:
+            oldest = next(iter(self.idempotency))
+            if len(self.idempotency) < IDEMPOTENCY_MAX_KEYS and now - self.idempotency[oldest]["at"] <= IDEMPOTENCY_TTL_SECONDS:
+                break
+            del self.idempotency[oldest]
+        self.idempotency[key] = {"fingerprint": fingerprint, "result": result, "at": now}
+        self._save("idempotency")
\ No newline at end of file
@@ -1,10 +1,14 @@
 from __future__ import annotations
-from typing import Dict, List, Optional
+import hashlib
+import json
+import math
+from typing import Any, Callable, Dict, List, Optional
 from .domain import (
     Product, Component, BomLine, Order, Movement, MovementLine, SerialUnit,
     utcnow_iso, OrderStatus, MovementType, UnitState
 )
 from .repositories import Repos
+from .forecast import shortage_forecast
 
 
 class AccountingService:
@@ -72,17 +76,35 @@ class AccountingService:
 
     # ---------- Inventory ----------
     def component_balance(self) -> Dict[str, int]:
-        bal: Dict[str, int] = {}
-        for mv in self.r.list_movements():
-            mtype = mv["type"]
-            sign = 1 if mtype in (MovementType.INCOME.value, MovementType.RETURN.value) else -1
-            for ln in mv["lines"]:
-                cid = ln["component_id"]
-                qty = int(ln["qty"])
-                bal[cid] = bal.get(cid, 0) + sign * qty
-        return bal
-
-    def register_movement(self, mtype: str, lines: List[Dict[str, int]], order_id: Optional[int] = None, note: str = "") -> int:
+        return dict(self.r.balances)
+
+    def shortage_forecast(self, detail: bool = False) -> List[Dict]:
+        return shortage_forecast(self.r, self.r.balances, detail)
+
+    def stock_valuation(self) -> List[Dict]:
+        return self.r.fifo.stock_valuation()
+
+    def order_material_costs(self) -> List[Dict]:
+        rows = []
+        for oid in sorted(self.r.fifo.order_cost):
+            o = self.r.get_order(oid)
+            cost = round(self.r.fifo.order_cost[oid], 2)
+            rows.append({
+                "order_id": oid,
+                "product_id": o["product_id"] if o else None,
+                "status": o["status"] if o else None,
+                "planned_qty": o["planned_qty"] if o else None,
+                "material_cost": cost,
+                "cost_per_unit": round(cost / o["planned_qty"], 4) if o else None,
+            })
+        return rows
+
+    def register_movement(self, mtype: str, lines: List[Dict[str, Any]], order_id: Optional[int] = None, note: str = "",
+                          idempotency_key: Optional[str] = None) -> int:
+        return self._idempotent(idempotency_key, ["movement", mtype, lines, order_id, note],
+                                lambda: self._register_movement(mtype, lines, order_id, note))
+
+    def _register_movement(self, mtype: str, lines: List[Dict[str, Any]], order_id: Optional[int], note: str) -> int:
         if mtype not in {x.value for x in MovementType}:
             raise ValueError("Unknown movement type")
 
@@ -100,11 +122,18 @@ class AccountingService:
                 raise ValueError("qty must be positive")
             if not self.r.get_component(cid):
                 raise ValueError(f"Unknown component: {cid}")
-            mv_lines.append(MovementLine(component_id=cid, qty=qty))
+            price = ln.get("unit_price")
+            if price is not None:
+                if mtype != MovementType.INCOME.value:
+                    raise ValueError("unit_price is allowed only on INCOME lines")
+                price = float(price)
+                if not math.isfinite(price) or price < 0:
+                    raise ValueError("unit_price must be a finite non-negative number")
+            mv_lines.append(MovementLine(component_id=cid, qty=qty, unit_price=price))
 
         # negative stock prevention
         if mtype in (MovementType.ISSUE.value, MovementType.WRITE_OFF.value):
-            bal = self.component_balance()
+            bal = self.r.balances
             for ln in mv_lines:
                 if bal.get(ln.component_id, 0) - ln.qty < 0:
                     raise ValueError(f"Negative stock is not allowed for component {ln.component_id}")
@@ -126,7 +155,11 @@ class AccountingService:
         return mid
 
     # ---------- Units ----------
-    def register_unit(self, order_id: int, serial_no: str) -> None:
+    def register_unit(self, order_id: int, serial_no: str, idempotency_key: Optional[str] = None) -> None:
+        self._idempotent(idempotency_key, ["unit_register", order_id, serial_no],
+                         lambda: self._register_unit(order_id, serial_no))
+
+    def _register_unit(self, order_id: int, serial_no: str) -> None:
         o = self._must_order(order_id)
         if o["status"] not in (OrderStatus.IN_PRODUCTION.value, OrderStatus.APPROVED.value):
             raise ValueError("Order must be approved or in production")
@@ -136,25 +169,67 @@ class AccountingService:
         u = SerialUnit(serial_no=serial_no, order_id=order_id, produced_at=utcnow_iso(), state=UnitState.PRODUCED.value)
         self.r.add_unit(u)
 
-    def record_test(self, serial_no: str, passed: bool) -> None:
+    def register_units(self, order_id: int, serial_nos: List[str]) -> None:
+        """Registers all serial numbers or none of them."""
+        o = self._must_order(order_id)
+        if o["status"] not in (OrderStatus.IN_PRODUCTION.value, OrderStatus.APPROVED.value):
+            raise ValueError("Order must be approved or in production")
+        if len(set(serial_nos)) != len(serial_nos):
+            raise ValueError("Duplicate serial numbers in request")
+        for sn in serial_nos:
+            if self.r.get_unit(sn):
+                raise ValueError(f"Serial number already exists: {sn}")
+        with self.r.batch():
+            for sn in serial_nos:
+                self._register_unit(order_id, sn)
+
+    def record_test(self, serial_no: str, passed: bool, idempotency_key: Optional[str] = None) -> None:
+        self._idempotent(idempotency_key, ["unit_test", serial_no, passed],
+                         lambda: self._record_test(serial_no, passed))
+
+    def _record_test(self, serial_no: str, passed: bool) -> None:
         u = self._must_unit(serial_no)
         if u["state"] in (UnitState.SHIPPED.value, UnitState.WRITTEN_OFF.value):
             raise ValueError("Cannot test shipped/written-off unit")
         self.r.update_unit_state(serial_no, UnitState.TEST_PASSED.value if passed else UnitState.TEST_FAILED.value)
 
-    def ship_unit(self, serial_no: str) -> None:
+    def ship_unit(self, serial_no: str, idempotency_key: Optional[str] = None) -> None:
+        self._idempotent(idempotency_key, ["unit_ship", serial_no], lambda: self._ship_unit(serial_no))
+
+    def _ship_unit(self, serial_no: str) -> None:
         u = self._must_unit(serial_no)
         if u["state"] != UnitState.TEST_PASSED.value:
             raise ValueError("Unit must have PASS test before shipment")
         self.r.update_unit_state(serial_no, UnitState.SHIPPED.value)
 
-    def write_off_unit(self, serial_no: str) -> None:
+    def write_off_unit(self, serial_no: str, idempotency_key: Optional[str] = None) -> None:
+        self._idempotent(idempotency_key, ["unit_write_off", serial_no], lambda: self._write_off_unit(serial_no))
+
+    def _write_off_unit(self, serial_no: str) -> None:
         u = self._must_unit(serial_no)
         if u["state"] == UnitState.SHIPPED.value:
             raise ValueError("Cannot write-off shipped unit")
         self.r.update_unit_state(serial_no, UnitState.WRITTEN_OFF.value)
 
     # ---------- Helpers ----------
+    def _idempotent(self, key: Optional[str], request: List[Any], fn: Callable[[], Any]) -> Any:
+        """
+        Runs fn once per idempotency key. A replay with the same request returns the stored
+        result without validating or writing anything; reusing a key for a different request fails.
+        """
+        if not key:
+            return fn()
+        fingerprint = hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        hit = self.r.get_idempotent(key)
+        if hit is not None:
+            if hit["fingerprint"] != fingerprint:
+                raise ValueError("Idempotency key was already used for a different request")
+            return hit["result"]
+        with self.r.batch():
+            result = fn()
+            self.r.put_idempotent(key, fingerprint, result)
+        return result
+
     def _must_order(self, order_id: int) -> Dict:
         o = self.r.get_order(order_id)
         if o is None:
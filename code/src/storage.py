@@ -1,7 +1,14 @@
 from __future__ import annotations
+import gc
 import json
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process use only
+    fcntl = None
 
 
 class JsonStore:
@@ -16,10 +23,48 @@ class JsonStore:
         p = self._path(name)
         if not p.exists():
             return default
-        return json.loads(p.read_text(encoding="utf-8"))
+        text = p.read_text(encoding="utf-8")
+        # decoded JSON has no reference cycles, and on big files the collector would rescan
+        # every container decoded so far many times over, doubling the load time
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return json.loads(text)
+        finally:
+            if enabled:
+                gc.enable()
 
-    def save(self, name: str, data: Any) -> None:
+    def save(self, name: str, data: Any, compact: bool = False) -> None:
         p = self._path(name)
         tmp = p.with_suffix(".json.tmp")
-        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
-        tmp.replace(p)
\ No newline at end of file
+        text = json.dumps(data, ensure_ascii=False, separators=(",", ":")) if compact else json.dumps(data, ensure_ascii=False, indent=2)
+        tmp.write_text(text, encoding="utf-8")
+        tmp.replace(p)
+        self._bump_generation()
+
+    def generation(self) -> int:
+        """Counter incremented by every save; processes compare it to decide whether to reload."""
+        try:
+            return int((self.base_dir / ".generation").read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _bump_generation(self) -> None:
+        # writers hold the exclusive lock(), so the read-increment-write cannot race
+        p = self.base_dir / ".generation"
+        tmp = p.with_suffix(".tmp")
+        tmp.write_text(str(self.generation() + 1), encoding="utf-8")
+        tmp.replace(p)
+
+    @contextmanager
+    def lock(self, shared: bool = False) -> Iterator[None]:
+        """Advisory lock on the data directory shared by all processes using it."""
+        if fcntl is None:
+            yield
+            return
+        with open(self.base_dir / ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
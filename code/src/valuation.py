@@ -0,0 +1,153 @@
+from __future__ import annotations
+from collections import deque
+from typing import Deque, Dict, List, Optional, Any, Union
+from .domain import MovementType
+
+_INCOME = MovementType.INCOME.value
+_RETURN = MovementType.RETURN.value
+_WRITE_OFF = MovementType.WRITE_OFF.value
+
+class FifoLedger:
+    """
+    FIFO cost layers per component, updated one movement at a time.
+
+    INCOME pushes a layer at its unit price, ISSUE/WRITE_OFF consume the oldest layers,
+    RETURN puts back what was last issued for the same order (or for unassigned issues).
+    Written-off stock is never put back; its cost is tracked per component.
+    Layers are [qty, unit_price]; adjacent layers with the same price are merged.
+    """
+    def __init__(self) -> None:
+        self.layers: Dict[str, Deque[List[Any]]] = {}
+        # (order_id or None) -> component_id -> consumed layers, most recent last
+        self.consumed: Dict[Optional[int], Dict[str, List[List[Any]]]] = {}
+        self.order_cost: Dict[int, float] = {}
+        self.written_off: Dict[str, int] = {}
+        self.write_off_cost: Dict[str, float] = {}
+        self.unpriced: Dict[str, int] = {}  # qty received without unit_price, valued at 0
+        self._last_price: Dict[str, float] = {}
+
+    def apply(self, mv: Dict[str, Any]) -> None:
+        mtype = mv["type"]
+        oid = mv.get("order_id")
+        for ln in mv["lines"]:
+            cid = ln["component_id"]
+            qty = int(ln["qty"])
+            if mtype == _INCOME:
+                price = ln.get("unit_price")
+                if price is None:
+                    self.unpriced[cid] = self.unpriced.get(cid, 0) + qty
+                    price = 0.0
+                self._push(cid, qty, float(price))
+                self._last_price[cid] = float(price)
+            elif mtype == _RETURN:
+                cost = self._restore(cid, qty, oid)
+                if oid is not None:
+                    self.order_cost[oid] = self.order_cost.get(oid, 0.0) - cost
+            else:
+                taken = self._consume(cid, qty)
+                cost = sum(q * p for q, p in taken)
+                if mtype == _WRITE_OFF:
+                    # kept off the consumed stacks so a RETURN cannot bring scrapped stock back
+                    self.written_off[cid] = self.written_off.get(cid, 0) + qty
+                    self.write_off_cost[cid] = self.write_off_cost.get(cid, 0.0) + cost
+                else:
+                    stack = self.consumed.setdefault(oid, {}).setdefault(cid, [])
+                    for layer in taken:
+                        _push_layer(stack, *layer)
+                if oid is not None:
+                    self.order_cost[oid] = self.order_cost.get(oid, 0.0) + cost
+
+    def _push(self, cid: str, qty: int, price: float) -> None:
+        _push_layer(self.layers.setdefault(cid, deque()), qty, price)
+
+    def _consume(self, cid: str, qty: int) -> List[List[Any]]:
+        layers = self.layers.setdefault(cid, deque())
+        taken: List[List[Any]] = []
+        while qty > 0 and layers:
+            head = layers[0]
+            q = min(qty, head[0])
+            taken.append([q, head[1]])
+            head[0] -= q
+            qty -= q
+            if head[0] == 0:
+                layers.popleft()
+        if qty > 0:
+            # only reachable with inconsistent history (stock went negative); cost it at 0
+            taken.append([qty, 0.0])
+        return taken
+
+    def _restore(self, cid: str, qty: int, oid: Optional[int]) -> float:
+        stack = self.consumed.get(oid, {}).get(cid, [])
+        layers = self.layers.setdefault(cid, deque())
+        cost = 0.0
+        while qty > 0 and stack:
+            top = stack[-1]
+            q = min(qty, top[0])
+            # returned stock was taken before anything still on hand, so it goes to the front
+            if layers and layers[0][1] == top[1]:
+                layers[0][0] += q
+            else:
+                layers.appendleft([q, top[1]])
+            cost += q * top[1]
+            top[0] -= q
+            qty -= q
+            if top[0] == 0:
+                stack.pop()
+        if qty > 0:
+            price = self._last_price.get(cid, 0.0)
+            layers.appendleft([qty, price])
+            cost += qty * price
+        return cost
+
+    # ---------- Snapshots ----------
+    def to_dict(self) -> Dict[str, Any]:
+        # JSON keys are strings: order ids are written as text, unassigned issues as ""
+        return {
+            "layers": {cid: list(layers) for cid, layers in self.layers.items()},
+            "consumed": {"" if oid is None else str(oid): {cid: st for cid, st in per.items() if st}
+                         for oid, per in self.consumed.items()},
+            "order_cost": {str(oid): cost for oid, cost in self.order_cost.items()},
+            "written_off": self.written_off,
+            "write_off_cost": self.write_off_cost,
+            "unpriced": self.unpriced,
+            "last_price": self._last_price,
+        }
+
+    @staticmethod
+    def from_dict(d: Dict[str, Any]) -> "FifoLedger":
+        ledger = FifoLedger()
+        ledger.layers = {cid: deque(layers) for cid, layers in d["layers"].items()}
+        ledger.consumed = {int(oid) if oid else None: per for oid, per in d["consumed"].items()}
+        ledger.order_cost = {int(oid): cost for oid, cost in d["order_cost"].items()}
+        ledger.written_off = d["written_off"]
+        ledger.write_off_cost = d["write_off_cost"]
+        ledger.unpriced = d["unpriced"]
+        ledger._last_price = d["last_price"]
+        return ledger
+
+    # ---------- Reports ----------
+    def stock_valuation(self) -> List[Dict[str, Any]]:
+        rows = []
+        for cid in sorted(self.layers):
+            qty = sum(q for q, _ in self.layers[cid])
+            value = sum(q * p for q, p in self.layers[cid])
+            if qty == 0 and value == 0 and cid not in self.written_off:
+                continue
+            rows.append({
+                "component_id": cid,
+                "qty": qty,
+                "value": round(value, 2),
+                "avg_unit_cost": round(value / qty, 4) if qty else 0.0,
+                "layers": len(self.layers[cid]),
+                "unpriced_received": self.unpriced.get(cid, 0),
+                "written_off_qty": self.written_off.get(cid, 0),
+                "written_off_value": round(self.write_off_cost.get(cid, 0.0), 2),
+            })
+        return rows
+
+
+def _push_layer(stack: Union[List[List[Any]], Deque[List[Any]]], qty: int, price: float) -> None:
+    if stack and stack[-1][1] == price:
+        stack[-1][0] += qty
+    else:
+        stack.append([qty, price])
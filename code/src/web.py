@@ -1,11 +1,16 @@
 from __future__ import annotations
 
+import os
+import threading
+import uuid
+from contextlib import ExitStack
 from pathlib import Path
-from flask import Flask, render_template, request, redirect, url_for, flash
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, g
 
 from .storage import JsonStore
 from .repositories import Repos
 from .services import AccountingService
+from . import profiling
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -16,12 +21,78 @@ app = Flask(
     static_folder=str(BASE_DIR / "static"),
     static_url_path="/static",
 )
-app.secret_key = "dev-secret"
-
-# init backend (same as CLI)
-store = JsonStore(BASE_DIR / "data")
-repos = Repos(store)
+app.secret_key = os.environ.get("ACCOUNTING_SECRET_KEY", "dev-secret")
+
+# ACCOUNTING_PROFILE=1 (or a directory) traces requests down to JsonStore; written on exit
+profiler = profiling.enable_from_env()
+if profiler is not None:
+    app.wsgi_app = profiler.wsgi_middleware(app.wsgi_app)
+
+# init backend (same as CLI). Under gunicorn --preload this runs once in the master
+# and the loaded collections are shared copy-on-write by the forked workers.
+store = JsonStore(Path(os.environ.get("ACCOUNTING_DATA_DIR", BASE_DIR / "data")))
+with store.lock(shared=True):
+    generation = store.generation()
+    repos = Repos(store)
 svc = AccountingService(repos)
+_state_lock = threading.RLock()
+
+
+def _reload_if_changed(write_locked: bool = False) -> None:
+    """Reloads the data when another worker (or the CLI) has written to the data directory."""
+    global repos, svc, generation
+    if store.generation() == generation:
+        return
+    with _state_lock, ExitStack() as stack:
+        if not write_locked:
+            stack.enter_context(store.lock(shared=True))
+        gen = store.generation()
+        if gen == generation:
+            return
+        r = Repos(store)
+        repos, svc, generation = r, AccountingService(r), gen
+
+
+@app.before_request
+def _sync_state():
+    # handlers run one at a time per process (also with WEB_THREADS > 1), so reads never see a
+    # write half-applied by another thread; writes are also serialised across worker processes
+    # and always start from fresh data. If taking a lock or reloading fails, whatever was
+    # already acquired is released here.
+    with ExitStack() as stack:
+        stack.enter_context(_state_lock)
+        if request.method == "POST":
+            stack.enter_context(store.lock())
+            _reload_if_changed(write_locked=True)
+            g.wrote = True
+        else:
+            _reload_if_changed()
+        g.state_lock = stack.pop_all()
+
+
+@app.teardown_request
+def _release_state_lock(exc):
+    global generation
+    stack = g.pop("state_lock", None)
+    if stack is not None:
+        if g.pop("wrote", False):
+            generation = store.generation()
+        stack.close()
+
+
+def _idempotency_key():
+    # scanners send a header; the forms carry a hidden field generated when the page is rendered
+    return request.headers.get("Idempotency-Key") or request.form.get("idempotency_key", "").strip() or None
+
+
+@app.get("/healthz")
+def healthz():
+    return jsonify({
+        "status": "ok",
+        "pid": os.getpid(),
+        "generation": generation,
+        "counts": {name: len(getattr(repos, name)) for name in ("products", "components", "orders", "movements", "units")},
+    })
 
 
 @app.get("/")
@@ -146,14 +217,14 @@ def order_approve_post():
 # ---------- Movements ----------
 @app.get("/movements/new")
 def movement_new():
-    return render_template("movement_new.html")
+    return render_template("movement_new.html", idempotency_key=uuid.uuid4().hex)
 
 
 @app.post("/movements/new")
 def movement_new_post():
     """
-    lines example:
-      C-01=10
+    lines example (unit price after @, INCOME only):
+      C-01=10@2.50
       C-02=5
     """
     try:
@@ -169,11 +240,16 @@ def movement_new_post():
             if not ln:
                 continue
             if "=" not in ln:
-                raise ValueError("Movement line format must be: component_id=qty")
+                raise ValueError("Movement line format must be: component_id=qty[@unit_price]")
             cid, qty = ln.split("=", 1)
-            lines.append({"component_id": cid.strip(), "qty": int(qty.strip())})
-
-        mid = svc.register_movement(mtype, lines, order_id, note)
+            line = {"component_id": cid.strip()}
+            if "@" in qty:
+                qty, price = qty.split("@", 1)
+                line["unit_price"] = float(price.strip())
+            line["qty"] = int(qty.strip())
+            lines.append(line)
+
+        mid = svc.register_movement(mtype, lines, order_id, note, idempotency_key=_idempotency_key())
         flash(f"Movement saved: movement_id={mid}", "ok")
         return redirect(url_for("index"))
     except Exception as e:
@@ -184,7 +260,7 @@ def movement_new_post():
 # ---------- Units ----------
 @app.get("/units/register")
 def unit_register():
-    return render_template("unit_register.html")
+    return render_template("unit_register.html", idempotency_key=uuid.uuid4().hex)
 
 
 @app.post("/units/register")
@@ -192,7 +268,7 @@ def unit_register_post():
     try:
         order_id = int(request.form["order_id"].strip())
         serial_no = request.form["serial_no"].strip()
-        svc.register_unit(order_id, serial_no)
+        svc.register_unit(order_id, serial_no, idempotency_key=_idempotency_key())
         flash("Serial unit registered", "ok")
         return redirect(url_for("index"))
     except Exception as e:
@@ -202,7 +278,7 @@ def unit_register_post():
 
 @app.get("/units/test")
 def unit_test():
-    return render_template("unit_test.html")
+    return render_template("unit_test.html", idempotency_key=uuid.uuid4().hex)
 
 
 @app.post("/units/test")
@@ -210,7 +286,7 @@ def unit_test_post():
     try:
         serial_no = request.form["serial_no"].strip()
         result = request.form["result"].strip().upper()
-        svc.record_test(serial_no, passed=(result == "PASS"))
+        svc.record_test(serial_no, passed=(result == "PASS"), idempotency_key=_idempotency_key())
         flash("Test recorded", "ok")
         return redirect(url_for("index"))
     except Exception as e:
@@ -220,14 +296,14 @@ def unit_test_post():
 
 @app.get("/units/ship")
 def unit_ship():
-    return render_template("unit_ship.html")
+    return render_template("unit_ship.html", idempotency_key=uuid.uuid4().hex)
 
 
 @app.post("/units/ship")
 def unit_ship_post():
     try:
         serial_no = request.form["serial_no"].strip()
-        svc.ship_unit(serial_no)
+        svc.ship_unit(serial_no, idempotency_key=_idempotency_key())
         flash("Unit shipped", "ok")
         return redirect(url_for("index"))
     except Exception as e:
@@ -243,6 +319,30 @@ def report_stock():
     return render_template("report_stock.html", rows=rows)
 
 
+@app.get("/reports/shortage")
+def report_shortage():
+    rows = svc.shortage_forecast(detail=True)
+    return render_template("report_shortage.html", rows=rows)
+
+
+@app.get("/api/shortage")
+def api_shortage():
+    return jsonify(svc.shortage_forecast(detail=request.args.get("detail") == "1"))
+
+
+@app.get("/reports/valuation")
+def report_valuation():
+    rows = svc.stock_valuation()
+    total = round(sum(r["value"] for r in rows), 2)
+    written_off = round(sum(r["written_off_value"] for r in rows), 2)
+    return render_template("report_valuation.html", rows=rows, total=total, written_off=written_off)
+
+
+@app.get("/reports/order-cost")
+def report_order_cost():
+    return render_template("report_order_cost.html", rows=svc.order_material_costs())
+
+
 def main():
     app.run(host="127.0.0.1", port=5000, debug=True)
 
@@ -0,0 +1,7 @@
+"""
+Production entry point:
+  gunicorn -c gunicorn.conf.py src.wsgi:app
+"""
+from .web import app
+
+application = app
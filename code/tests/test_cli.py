@@ -0,0 +1,103 @@
+import io
+import tempfile
+import unittest
+from unittest import mock
+from pathlib import Path
+
+from src.storage import JsonStore
+from src.repositories import Repos
+from src.services import AccountingService
+from src.cli import build_parser, run_script
+
+SCRIPT = """\
+# comments and blank lines are skipped
+
+component add C1 Bolt
+movement add INCOME C1=5
+movement add ISSUE C9=1
+component add C2 Nut
+"""
+
+
+class ScriptTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.base = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _run(self, script: str, keep_going: bool = False):
+        out, err = io.StringIO(), io.StringIO()
+        rc = run_script(AccountingService(Repos(JsonStore(self.base))), io.StringIO(script), keep_going, out, err)
+        return rc, err.getvalue(), AccountingService(Repos(JsonStore(self.base)))
+
+    def test_first_failing_line_aborts_without_saving(self):
+        rc, err, svc = self._run(SCRIPT)
+        self.assertEqual(rc, 1)
+        self.assertIn("ERROR line 5:", err)
+        self.assertIn("Aborted, nothing was saved.", err)
+        self.assertEqual(svc.r.components, {})
+        self.assertEqual(svc.r.movements, {})
+
+    def test_keep_going_saves_the_other_lines(self):
+        rc, err, svc = self._run(SCRIPT + "no-such-command\n", keep_going=True)
+        self.assertEqual(rc, 1)
+        self.assertEqual([ln.split(":")[0] for ln in err.splitlines()], ["ERROR line 5", "ERROR line 7"])
+        self.assertEqual(sorted(svc.r.components), ["C1", "C2"])
+        self.assertEqual(svc.component_balance(), {"C1": 5})
+
+    def test_clean_script_succeeds(self):
+        rc, err, svc = self._run("component add C1 Bolt\nmovement add INCOME C1=5\n")
+        self.assertEqual((rc, err), (0, ""))
+        self.assertEqual(svc.component_balance(), {"C1": 5})
+
+
+class RegisterRangeTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.base = Path(self._tmp.name)
+        self.svc = AccountingService(Repos(JsonStore(self.base)))
+        self.svc.create_component("C1", "Bolt")
+        self.svc.create_product("P1", "Panel")
+        self.svc.set_bom("P1", [{"component_id": "C1", "qty_per_unit": 1}])
+        self.oid = self.svc.create_order("P1", 10)
+        self.svc.approve_order(self.oid)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _register_range(self, *args: str) -> str:
+        out = io.StringIO()
+        a = build_parser().parse_args(["unit", "register-range", str(self.oid), *args])
+        a.func(self.svc, a, out)
+        return out.getvalue()
+
+    def test_range_is_registered_with_padded_serials(self):
+        self.assertEqual(self._register_range("--prefix", "SN-", "--start", "9", "--count", "3", "--width", "3"),
+                         "OK registered=3\n")
+        self.assertEqual(sorted(Repos(JsonStore(self.base)).units), ["SN-009", "SN-010", "SN-011"])
+
+    def test_existing_serial_registers_none_of_the_range(self):
+        self.svc.register_unit(self.oid, "SN-0003")
+        with self.assertRaisesRegex(ValueError, "already exists: SN-0003"):
+            self._register_range("--prefix", "SN-", "--count", "5")
+        self.assertEqual(list(Repos(JsonStore(self.base)).units), ["SN-0003"])
+
+    def test_failed_write_registers_none_of_the_range(self):
+        save = JsonStore.save
+
+        def failing_save(store, name, data, **kwargs):
+            if name == "units":
+                raise OSError("disk full")
+            save(store, name, data, **kwargs)
+
+        with mock.patch.object(JsonStore, "save", failing_save):
+            with self.assertRaises(OSError):
+                self._register_range("--prefix", "SN-", "--count", "5")
+        self.assertEqual(self.svc.r.units, {})
+        self.assertEqual(Repos(JsonStore(self.base)).units, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from src import forecast
+from src.storage import JsonStore
+from src.repositories import Repos
+from src.services import AccountingService
+
+
+class ShortageForecastTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.svc = AccountingService(Repos(JsonStore(Path(self._tmp.name))))
+        for cid in ("C1", "C2", "C3"):
+            self.svc.create_component(cid, cid)
+        self.svc.create_product("P1", "Panel")
+        self.svc.set_bom("P1", [{"component_id": "C1", "qty_per_unit": 2},
+                                {"component_id": "C2", "qty_per_unit": 1},
+                                {"component_id": "C3", "qty_per_unit": 1}])
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _order(self, qty, deadline=None):
+        oid = self.svc.create_order("P1", qty, deadline)
+        self.svc.approve_order(oid)
+        return oid
+
+    def test_orders_are_served_in_deadline_order(self):
+        self.svc.register_movement("INCOME", [{"component_id": "C1", "qty": 10},
+                                              {"component_id": "C2", "qty": 100},
+                                              {"component_id": "C3", "qty": 100}])
+        late = self._order(4, "2026-03-01")
+        early = self._order(3, "2026-02-01")
+        undated = self._order(1)  # no deadline: last
+        rows = self.svc.shortage_forecast()
+        self.assertEqual([r["order_id"] for r in rows], [late, undated])
+        self.assertEqual(rows[0]["first_shortage"],
+                         {"component_id": "C1", "required": 8, "available": 4, "missing": 4})
+        self.assertNotIn(early, [r["order_id"] for r in rows])
+        self.assertNotIn("shortages", rows[0])
+
+    def test_first_shortage_is_smallest_available_share(self):
+        # C1 covers 3 of 4, C2 1 of 2, C3 nothing: C3 runs out first, then C2, then C1
+        self.svc.register_movement("INCOME", [{"component_id": "C1", "qty": 3},
+                                              {"component_id": "C2", "qty": 1}])
+        self._order(2)
+        [row] = self.svc.shortage_forecast(detail=True)
+        self.assertEqual(row["first_shortage"]["component_id"], "C3")
+        self.assertEqual(row["short_components"], 3)
+        self.assertEqual([s["component_id"] for s in row["shortages"]], ["C3", "C2", "C1"])
+
+    def test_ties_go_to_lowest_component_id(self):
+        self._order(1)
+        [row] = self.svc.shortage_forecast()
+        self.assertEqual(row["first_shortage"]["component_id"], "C1")
+
+    def test_same_result_for_any_block_size(self):
+        self.svc.register_movement("INCOME", [{"component_id": "C1", "qty": 15},
+                                              {"component_id": "C2", "qty": 9},
+                                              {"component_id": "C3", "qty": 4}])
+        for i in range(12):
+            self._order(1 + i % 3, f"2026-01-{i + 1:02d}")
+        expected = self.svc.shortage_forecast(detail=True)
+        old = forecast.BLOCK_CELLS
+        try:
+            for cells in (1, 4, 7):
+                forecast.BLOCK_CELLS = cells
+                self.assertEqual(self.svc.shortage_forecast(detail=True), expected)
+        finally:
+            forecast.BLOCK_CELLS = old
+
+    def test_issued_quantities_reduce_the_requirement(self):
+        self.svc.create_product("P2", "Fuse")
+        self.svc.set_bom("P2", [{"component_id": "C1", "qty_per_unit": 1}])
+        self.svc.register_movement("INCOME", [{"component_id": "C1", "qty": 10}])
+        first = self.svc.create_order("P2", 10, "2026-01-01")
+        self.svc.approve_order(first)
+        second = self.svc.create_order("P2", 3, "2026-01-02")
+        self.svc.approve_order(second)
+        self.svc.register_movement("ISSUE", [{"component_id": "C1", "qty": 6}], first)
+        # 4 in stock cover the rest of the first order, the second gets nothing
+        [row] = self.svc.shortage_forecast()
+        self.assertEqual((row["order_id"], row["first_shortage"]["missing"]), (second, 3))
+
+    def test_returns_beyond_issues_do_not_add_to_the_requirement(self):
+        self.svc.create_product("P2", "Fuse")
+        self.svc.set_bom("P2", [{"component_id": "C1", "qty_per_unit": 1}])
+        self.svc.register_movement("INCOME", [{"component_id": "C1", "qty": 8}])
+        first = self.svc.create_order("P2", 10, "2026-01-01")
+        self.svc.approve_order(first)
+        second = self.svc.create_order("P2", 3, "2026-01-02")
+        self.svc.approve_order(second)
+        self.svc.register_movement("RETURN", [{"component_id": "C1", "qty": 4}], first)
+        self.assertEqual(self.svc.component_balance()["C1"], 12)
+        [row] = self.svc.shortage_forecast(detail=True)
+        self.assertEqual(row["order_id"], second)
+        self.assertEqual(row["first_shortage"], {"component_id": "C1", "required": 3, "available": 2, "missing": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src import repositories
+from src.storage import JsonStore
+from src.repositories import Repos, IDEMPOTENCY_TTL_SECONDS
+from src.services import AccountingService
+
+INCOME = [{"component_id": "C1", "qty": 5}]
+
+
+class IdempotencyTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.base = Path(self._tmp.name)
+        self.store = JsonStore(self.base)
+        self.svc = AccountingService(Repos(self.store))
+        self.svc.create_component("C1", "Bolt")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _reopen(self) -> AccountingService:
+        return AccountingService(Repos(JsonStore(self.base)))
+
+    def test_replay_returns_original_result_without_writing(self):
+        mid = self.svc.register_movement("INCOME", INCOME, idempotency_key="scan-1")
+        with mock.patch.object(JsonStore, "save") as save:
+            self.assertEqual(self.svc.register_movement("INCOME", INCOME, idempotency_key="scan-1"), mid)
+            self.assertEqual(self._reopen().register_movement("INCOME", INCOME, idempotency_key="scan-1"), mid)
+        save.assert_not_called()
+        self.assertEqual(self._reopen().component_balance(), {"C1": 5})
+
+    def test_key_reused_for_different_request_fails(self):
+        self.svc.register_movement("INCOME", INCOME, idempotency_key="scan-1")
+        with self.assertRaisesRegex(ValueError, "different request"):
+            self.svc.register_movement("INCOME", [{"component_id": "C1", "qty": 6}], idempotency_key="scan-1")
+        self.assertEqual(self.svc.component_balance(), {"C1": 5})
+
+    def test_expired_key_runs_again(self):
+        first = self.svc.register_movement("INCOME", INCOME, idempotency_key="scan-1")
+        self.svc.r.idempotency["scan-1"]["at"] -= IDEMPOTENCY_TTL_SECONDS + 1
+        second = self.svc.register_movement("INCOME", INCOME, idempotency_key="scan-1")
+        self.assertNotEqual(first, second)
+        self.assertEqual(self.svc.component_balance(), {"C1": 10})
+
+    def test_oldest_keys_are_evicted_beyond_the_limit(self):
+        with mock.patch.object(repositories, "IDEMPOTENCY_MAX_KEYS", 3):
+            for i in range(4):
+                self.svc.register_movement("INCOME", INCOME, idempotency_key=f"scan-{i}")
+        stored = json.loads((self.base / "idempotency.json").read_text(encoding="utf-8"))
+        self.assertEqual(list(stored), ["scan-1", "scan-2", "scan-3"])
+
+    def test_failed_write_is_redone_on_retry(self):
+        save = JsonStore.save
+
+        def failing_save(store, name, data, **kwargs):
+            if name == "movements":
+                raise OSError("disk full")
+            save(store, name, data, **kwargs)
+
+        with mock.patch.object(JsonStore, "save", failing_save):
+            with self.assertRaises(OSError):
+                self.svc.register_movement("INCOME", INCOME, idempotency_key="scan-1")
+        self.assertNotIn("scan-1", self._reopen().r.idempotency)
+
+        # retried by the same process and after a restart: exactly one movement is stored
+        mid = self.svc.register_movement("INCOME", INCOME, idempotency_key="scan-1")
+        self.assertEqual(self._reopen().register_movement("INCOME", INCOME, idempotency_key="scan-1"), mid)
+        reopened = self._reopen()
+        self.assertEqual(list(reopened.r.movements), [str(mid)])
+        self.assertEqual(reopened.component_balance(), {"C1": 5})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src.storage import JsonStore
+from src.repositories import Repos, IDEMPOTENCY_TTL_SECONDS
+from src.services import AccountingService
+from src.integrity import check
+from src import main as cli_main
+
+CODE_DIR = Path(__file__).resolve().parent.parent
+
+
+def _write(base: Path, name: str, data) -> None:
+    (base / f"{name}.json").write_text(json.dumps(data), encoding="utf-8")
+
+
+class CheckMalformedDataTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.base = Path(self._tmp.name)
+        _write(self.base, "meta", {"next_order_id": 1, "next_movement_id": 3})
+        _write(self.base, "components", {"C1": {"component_id": "C1", "name": "Bolt", "uom": "pcs"}})
+        _write(self.base, "movements", {
+            "1": {"movement_id": 1, "type": "INCOME", "order_id": None, "lines": [{"component_id": "C1", "qty": 5}]},
+            "2": {"movement_id": 2, "type": "ISSUE", "order_id": None, "lines": [{"component_id": "C1", "qty": "ten"}]},
+            "x7": {"movement_id": "x7", "type": "ISSUE", "order_id": None, "lines": [{"component_id": "C1", "qty": 1}]},
+        })
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_check_reports_instead_of_raising(self):
+        repos = Repos(JsonStore(self.base))
+        self.assertEqual(repos.balances, {"C1": 4})
+        found = {(v.record_id, v.message) for v in check(repos, workers=1)}
+        self.assertIn(("2", "invalid qty 'ten' for 'C1'"), found)
+        self.assertIn(("x7", "movement key is not a number"), found)
+
+    def test_check_reports_records_of_the_wrong_shape(self):
+        store = JsonStore(self.base)
+        movements = store.load("movements", {})
+        movements["3"] = "garbage"
+        movements["4"] = {"movement_id": 4, "type": ["ISSUE"], "order_id": None, "lines": []}
+        movements["5"] = {"movement_id": 5, "type": "ISSUE", "order_id": None,
+                          "lines": [{"component_id": ["C1"], "qty": 1}]}
+        store.save("movements", movements)
+        store.save("units", {"SN-1": ["not", "a", "unit"], "SN-2": {"serial_no": "SN-2", "order_id": 1, "state": {}}})
+        store.save("orders", {"1": {"order_id": 1, "product_id": ["P1"], "status": "approved"}})
+        found = {(v.collection, v.record_id, v.message) for v in check(Repos(store, derived=False), workers=1)}
+        self.assertIn(("movements", "3", "record is not an object"), found)
+        self.assertIn(("movements", "4", "unknown type ['ISSUE']"), found)
+        self.assertIn(("movements", "5", "references missing component ['C1']"), found)
+        self.assertIn(("units", "SN-1", "record is not an object"), found)
+        self.assertIn(("units", "SN-2", "unknown state {}"), found)
+        self.assertIn(("orders", "1", "references missing product ['P1']"), found)
+
+    def test_non_numeric_keys_are_replayed_last_like_the_balances(self):
+        store = JsonStore(self.base)
+        store.save("movements", {
+            "x7": {"movement_id": "x7", "type": "INCOME", "order_id": None, "lines": [{"component_id": "C1", "qty": 10}]},
+            "1": {"movement_id": 1, "type": "INCOME", "order_id": None, "lines": [{"component_id": "C1", "qty": 1}]},
+            "2": {"movement_id": 2, "type": "ISSUE", "order_id": None, "lines": [{"component_id": "C1", "qty": 5}]},
+        })
+        repos = Repos(store)
+        self.assertEqual([k for k, _ in repos.movement_items()], ["1", "2", "x7"])
+        found = {(v.record_id, v.message) for v in check(repos, workers=1)}
+        self.assertIn(("2", "stock of 'C1' goes negative"), found)
+
+    def test_check_command_does_not_replay_on_load(self):
+        argv = ["accounting", "--data-dir", str(self.base), "check"]
+        with mock.patch("sys.argv", argv), mock.patch.object(Repos, "rebuild_stock") as replay, \
+                mock.patch("sys.stdout"), self.assertRaises(SystemExit) as exit_:
+            cli_main.main()
+        self.assertEqual(exit_.exception.code, 1)
+        replay.assert_not_called()
+
+    def test_cli_check_exits_with_violations(self):
+        proc = subprocess.run(
+            [sys.executable, "-m", "src.main", "--data-dir", str(self.base), "check", "--format", "csv"],
+            cwd=CODE_DIR, capture_output=True, text=True,
+        )
+        self.assertEqual(proc.returncode, 1, proc.stderr)
+        self.assertNotIn("Traceback", proc.stderr)
+        self.assertIn("invalid qty 'ten'", proc.stdout)
+
+
+class RebuildDerivedTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.base = Path(self._tmp.name)
+        svc = AccountingService(Repos(JsonStore(self.base)))
+        svc.create_component("C1", "Bolt")
+        svc.register_movement("INCOME", [{"component_id": "C1", "qty": 4, "unit_price": 1.0}], idempotency_key="old")
+        svc.register_movement("INCOME", [{"component_id": "C1", "qty": 6, "unit_price": 2.0}], idempotency_key="new")
+        svc.r.save_fifo_snapshot()
+        self.expected = svc.stock_valuation()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_stored_derived_state_is_rewritten_once(self):
+        store = JsonStore(self.base)
+        snap = store.load("fifo", None)
+        snap["ledger"]["layers"]["C1"] = [[10, 9.0]]
+        store.save("fifo", snap)
+        keys = store.load("idempotency", {})
+        keys["old"]["at"] -= IDEMPOTENCY_TTL_SECONDS + 1
+        keys["broken"] = "not an entry"
+        store.save("idempotency", keys)
+        _write(self.base, "meta", {"next_order_id": 1, "next_movement_id": 2, "fifo_movements": 2})
+
+        changes = Repos(JsonStore(self.base), derived=False).rebuild_derived()
+        self.assertEqual(changes, ["next_movement_id 2 -> 3", "FIFO snapshot rewritten for 2 movements",
+                                   "2 expired, malformed or excess idempotency keys dropped"])
+        repos = Repos(JsonStore(self.base))
+        self.assertEqual(list(repos.idempotency), ["new"])
+        self.assertEqual(AccountingService(repos).stock_valuation(), self.expected)
+        self.assertEqual(repos.rebuild_derived(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
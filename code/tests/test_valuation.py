@@ -0,0 +1,95 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from src import repositories
+from src.storage import JsonStore
+from src.repositories import Repos
+from src.services import AccountingService
+from src.valuation import FifoLedger
+
+
+def _mv(mtype, *lines, order_id=None):
+    return {"type": mtype, "order_id": order_id,
+            "lines": [{"component_id": cid, "qty": qty, **({"unit_price": p} if p is not None else {})}
+                      for cid, qty, p in lines]}
+
+
+class FifoLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.ledger = FifoLedger()
+        self.ledger.apply(_mv("INCOME", ("C1", 10, 1.0)))
+        self.ledger.apply(_mv("INCOME", ("C1", 10, 2.0)))
+
+    def test_issue_consumes_oldest_layers_first(self):
+        self.ledger.apply(_mv("ISSUE", ("C1", 15, None), order_id=1))
+        self.assertEqual(self.ledger.order_cost, {1: 10 * 1.0 + 5 * 2.0})
+        self.assertEqual(list(self.ledger.layers["C1"]), [[5, 2.0]])
+
+    def test_return_restores_last_consumed_layers_to_the_front(self):
+        self.ledger.apply(_mv("ISSUE", ("C1", 15, None), order_id=1))
+        self.ledger.apply(_mv("RETURN", ("C1", 7, None), order_id=1))
+        # the 5 @ 2.0 taken last come back first, then 2 of the 10 @ 1.0
+        self.assertEqual(list(self.ledger.layers["C1"]), [[2, 1.0], [10, 2.0]])
+        self.assertEqual(self.ledger.order_cost, {1: 8 * 1.0})
+
+    def test_write_off_is_costed_and_never_returned(self):
+        self.ledger.apply(_mv("ISSUE", ("C1", 4, None)))
+        self.ledger.apply(_mv("WRITE_OFF", ("C1", 6, None)))
+        self.ledger.apply(_mv("RETURN", ("C1", 4, None)))
+        [row] = self.ledger.stock_valuation()
+        self.assertEqual((row["written_off_qty"], row["written_off_value"]), (6, 6.0))
+        self.assertEqual((row["qty"], row["value"]), (14, 4 * 1.0 + 10 * 2.0))
+
+    def test_snapshot_round_trip(self):
+        self.ledger.apply(_mv("ISSUE", ("C1", 12, None), order_id=3))
+        self.ledger.apply(_mv("ISSUE", ("C1", 1, None)))
+        self.ledger.apply(_mv("WRITE_OFF", ("C1", 1, None)))
+        copy = FifoLedger.from_dict(json.loads(json.dumps(self.ledger.to_dict())))
+        for ledger in (self.ledger, copy):
+            ledger.apply(_mv("RETURN", ("C1", 3, None), order_id=3))
+        self.assertEqual(json.dumps(copy.to_dict()), json.dumps(self.ledger.to_dict()))
+        self.assertEqual(copy.stock_valuation(), self.ledger.stock_valuation())
+
+
+class FifoSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.base = Path(self._tmp.name)
+        svc = AccountingService(Repos(JsonStore(self.base)))
+        svc.create_component("C1", "Bolt")
+        with mock.patch.object(repositories, "FIFO_SNAPSHOT_EVERY", 3):
+            for i in range(4):
+                svc.register_movement("INCOME", [{"component_id": "C1", "qty": 1, "unit_price": i + 1.0}])
+        self.expected = svc.stock_valuation()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_snapshot_plus_tail_matches_full_replay(self):
+        repos = Repos(JsonStore(self.base))
+        self.assertEqual(repos.store.load("fifo", None)["movements"], 3)
+        with mock.patch.object(FifoLedger, "apply", autospec=True, side_effect=FifoLedger.apply) as apply:
+            self.assertEqual(AccountingService(repos).stock_valuation(), self.expected)
+        self.assertEqual(apply.call_count, 1)
+        self.assertEqual(repos.build_fifo(use_snapshot=False).to_dict(), repos.fifo.to_dict())
+
+    def test_stale_snapshot_is_ignored(self):
+        store = JsonStore(self.base)
+        snap = store.load("fifo", None)
+        snap["last_movement_id"] = "99"
+        store.save("fifo", snap)
+        self.assertEqual(AccountingService(Repos(store)).stock_valuation(), self.expected)
+
+    def test_commands_that_do_not_value_stock_skip_the_ledger(self):
+        with mock.patch.object(FifoLedger, "apply") as apply:
+            svc = AccountingService(Repos(JsonStore(self.base)))
+            svc.create_product("P1", "Panel")
+            svc.register_movement("INCOME", [{"component_id": "C1", "qty": 1}])
+        apply.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""
+Times the shortage forecast on generated data (nothing is written to disk).
+
+  python3 tools/bench_forecast.py                      # 10k orders x 5k components
+  python3 tools/bench_forecast.py --orders 2000 --components 500 --detail
+
+Scenarios: "dense" (every product uses every component, no stock, so everything is short),
+"stocked" (dense, but stock covers roughly half of the demand) and "sparse"
+(40 components per product, random stock).
+"""
+from __future__ import annotations
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Tuple
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from src.storage import JsonStore  # noqa: E402
+from src.repositories import Repos  # noqa: E402
+from src.forecast import shortage_forecast  # noqa: E402
+
+SCENARIOS = ("dense", "stocked", "sparse")
+
+
+def build(scenario: str, n_orders: int, n_components: int, n_products: int, seed: int = 1) -> Tuple[Repos, Dict[str, int]]:
+    rnd = random.Random(seed)
+    repos = Repos(JsonStore(Path(tempfile.mkdtemp(prefix="bench-forecast-"))))
+    cids = [f"C{j:05d}" for j in range(n_components)]
+    per_product = n_components if scenario != "sparse" else min(40, n_components)
+    repos.bom = {
+        f"P{i}": [{"component_id": c, "qty_per_unit": rnd.randint(1, 4)} for c in rnd.sample(cids, per_product)]
+        for i in range(n_products)
+    }
+    repos.orders = {
+        str(k): {"order_id": k, "product_id": f"P{rnd.randrange(n_products)}", "planned_qty": rnd.randint(1, 50),
+                 "status": "approved", "deadline": f"2026-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}"}
+        for k in range(1, n_orders + 1)
+    }
+    if scenario == "dense":
+        balance: Dict[str, int] = {}
+    elif scenario == "stocked":
+        # each order needs on average 25 * 2.5 of every component
+        balance = {c: int(n_orders * 25 * 2.5 * rnd.uniform(0.4, 0.6)) for c in cids}
+    else:
+        balance = {c: rnd.randint(0, 20_000) for c in cids}
+    return repos, balance
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--orders", type=int, default=10_000)
+    p.add_argument("--components", type=int, default=5_000)
+    p.add_argument("--products", type=int, default=50)
+    p.add_argument("--scenario", choices=SCENARIOS, action="append", dest="scenarios")
+    p.add_argument("--detail", action="store_true", help="also list every short component")
+    p.add_argument("--repeat", type=int, default=3)
+    args = p.parse_args()
+
+    for scenario in args.scenarios or SCENARIOS:
+        repos, balance = build(scenario, args.orders, args.components, args.products)
+        best = float("inf")
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            rows = shortage_forecast(repos, balance, detail=args.detail)
+            best = min(best, time.perf_counter() - t0)
+        print(f"{scenario:<8} {args.orders} orders x {args.components} components: "
+              f"{best * 1e3:8.1f} ms (best of {args.repeat}), {len(rows)} short orders")
+
+
+if __name__ == "__main__":
+    main()
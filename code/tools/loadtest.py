@@ -0,0 +1,75 @@
+"""
+Simple closed-loop load generator for read-heavy report traffic.
+
+  python3 tools/loadtest.py http://127.0.0.1:5000 --concurrency 16 --duration 10
+  python3 tools/loadtest.py http://127.0.0.1:8000 --concurrency 16 --duration 10
+
+Each client keeps one HTTP/1.1 connection open and cycles through the paths.
+"""
+from __future__ import annotations
+import argparse
+import http.client
+import threading
+import time
+from typing import List
+from urllib.parse import urlsplit
+
+DEFAULT_PATHS = ["/reports/stock", "/reports/shortage", "/api/shortage", "/healthz"]
+
+
+def _client(host: str, port: int, paths: List[str], deadline: float, latencies: List[float], errors: List[int]) -> None:
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status != 200:
+                errors.append(resp.status)
+        except (OSError, http.client.HTTPException):
+            errors.append(0)
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - t0)
+    conn.close()
+
+
+def main() -> None:
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("url", help="base URL, e.g. http://127.0.0.1:8000")
+    p.add_argument("--concurrency", type=int, default=8)
+    p.add_argument("--duration", type=float, default=10.0, help="seconds")
+    p.add_argument("--path", action="append", dest="paths", help="path to request (repeatable)")
+    a = p.parse_args()
+
+    u = urlsplit(a.url)
+    paths = a.paths or DEFAULT_PATHS
+    deadline = time.perf_counter() + a.duration
+    per_client: List[List[float]] = [[] for _ in range(a.concurrency)]
+    errors: List[int] = []
+    threads = [threading.Thread(target=_client, args=(u.hostname, u.port or 80, paths, deadline, lat, errors))
+               for lat in per_client]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    lat = sorted(x for xs in per_client for x in xs)
+    if not lat:
+        print(f"no successful requests ({len(errors)} errors)")
+        return
+    pct = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000
+    print(f"requests: {len(lat)}  errors: {len(errors)}  elapsed: {elapsed:.1f}s")
+    print(f"throughput: {len(lat) / elapsed:.1f} req/s")
+    print(f"latency ms: p50 {pct(0.50):.1f}  p90 {pct(0.90):.1f}  p99 {pct(0.99):.1f}  max {lat[-1] * 1000:.1f}")
+
+
+if __name__ == "__main__":
+    main()